@@ -0,0 +1,71 @@
+'''Measures how long it takes to import the bot's entry points in a fresh
+interpreter, using the report from ``python -X importtime``.
+
+Usage: benchmark-startup.py [module ...]
+
+For each module (by default, the ones on the bot's startup paths) this prints
+the total import time, the wall clock time to start an interpreter and import
+the module, and the modules that take the most time to import themselves.'''
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_MODULES = (
+    'run',
+    'pingbot',
+    'pingbot.chat.terminal',
+    'pingbot.chat.stackexchange',
+)
+
+REPEAT = 5
+TOP = 10
+
+def import_times(module):
+    '''Imports ``module`` in a new interpreter and returns a list of
+    (module name, self time, cumulative time) for each module imported, with
+    times in microseconds, along with the wall clock time in seconds.'''
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError('Importing {} failed:\n{}'.format(module, result.stderr))
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+    return times, elapsed
+
+def report(module):
+    runs = [import_times(module) for i in range(REPEAT)]
+    # the module itself is the last one reported
+    totals = [times[-1][2] for times, elapsed in runs]
+    walls = [elapsed for times, elapsed in runs]
+    print('{}: import {:.1f} ms, interpreter start + import {:.1f} ms (median of {})'.format(
+        module,
+        statistics.median(totals) / 1000.,
+        statistics.median(walls) * 1000.,
+        REPEAT
+    ))
+    times, elapsed = runs[-1]
+    for name, self_us, cumulative_us in sorted(times, key=lambda t: t[1], reverse=True)[:TOP]:
+        print('    {:8.1f} ms self {:8.1f} ms cumulative  {}'.format(self_us / 1000., cumulative_us / 1000., name))
+
+def main():
+    for module in sys.argv[1:] or DEFAULT_MODULES:
+        try:
+            report(module)
+        except RuntimeError as e:
+            print(e)
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,60 @@
-import copy
-import io
+import contextlib
 import logging
 import math
 import random
 import re
 import time
 
-from ChatExchange.chatexchange.events import MessagePosted
-
-from pingbot.moderators import moderators, update as update_moderators
-from pingbot.sites import canonical_site_id, site_name as get_site_name
+from pingbot.chat import MESSAGE_POSTED, intersection
+from pingbot.moderators import update as update_moderators, moderator_info, find_moderators, site_ids, site_moderators
+from pingbot.pingledger import PingLedger, format_elapsed
+from pingbot.profiling import profiled, profiler
+from pingbot.render import PingStringCache, build_messages
+from pingbot.ratelimit import INFO, PING, SUPERPING, ADMIN, RateLimiter
+from pingbot.settings import on_reload as on_settings_reload, remove_on_reload as remove_on_settings_reload
+from pingbot.sites import canonical_site_id, site_display_name
 
 logger = logging.getLogger('pingbot')
 
 HELP = '''"whois [sitename] mods" works as in TL.
+"whois @username" lists the sites that user moderates.
 "[sitename] mod" or "any [sitename] mod" pings a single mod of the site, one who is in the room if possible.
 "[sitename] mods" pings all mods of the site currently in the room, or if none are present, does nothing.
 "all [sitename] mods" pings all mods of the site, period.
+In all of these, [sitename] can be a list of sites separated by commas or slashes, like "physics, astronomy mods", and each mod is pinged only once. "* mod" and "* mods" use every known site.
 "sites" gives a list of pingable sites (not including some aliases which are also recognized).
 Pings can optionally be followed by a colon and a message.'''
 
-WHOIS = re.compile(r'who(?:is|are) (\w+) mods$')
-ANYPING = re.compile(r'(?:any )?(\w+) mod(?:\s*:\s*(.+))?$')
-HEREPING = re.compile(r'(\w+) mods(?:\s*:\s*(.+))?$')
-ALLPING = re.compile(r'all (\w+) mods(?:\s*:\s*(.+))?$')
+WILDCARD = '*'
+# One or more site IDs separated by commas or slashes, or the wildcard
+SITES = r'(\*|\w+(?:\s*[,/]\s*\w+)*)'
+SITE_SEPARATOR = re.compile(r'\s*[,/]\s*')
+
+WHOIS = re.compile(r'who(?:is|are) ' + SITES + r' mods$')
+WHOIS_USER = re.compile(r'who(?:is|are) @(@?)(\S+)$')
+ANYPING = re.compile(r'(?:any )?' + SITES + r' mod(?:\s*:\s*(.+))?$')
+HEREPING = re.compile(SITES + r' mods(?:\s*:\s*(.+))?$')
+ALLPING = re.compile(r'all ' + SITES + r' mods(?:\s*:\s*(.+))?$')
+PROFILE = re.compile(r'profile(?: (on|off))?$')
+
+def parse_site_ids(sites):
+    '''Splits a site list as matched by ``SITES`` into a list of distinct
+    canonical site IDs, in the order given. The wildcard expands to all sites
+    with moderator info.'''
+    if sites == WILDCARD:
+        return sorted(site_ids())
+    result = []
+    for site_id in SITE_SEPARATOR.split(sites):
+        site_id = canonical_site_id(site_id)
+        if site_id not in result:
+            result.append(site_id)
+    return result
+
+def get_site_names(sites):
+    '''Gives the names of the sites in a site list, for use in messages.'''
+    if sites == WILDCARD:
+        return 'any site'
+    return ', '.join(site_display_name(s) for s in parse_site_ids(sites))
 
 class UnknownSiteException(Exception):
     def __init__(self, site_id):
@@ -41,8 +72,9 @@ class NoOtherModeratorsException(Exception):
 class Dispatcher(object):
     NO_INFO = 'No moderator info for site {}.'
     NO_OTHERS = 'No other moderators for site {}.'
+    NO_WILDCARD = 'That would include every moderator I know of. Please name the sites.'
 
-    def __init__(self, room, tl=None):
+    def __init__(self, room, tl=None, rate_limiter=None, ping_ledger=None, settings=None):
         '''Constructs a message dispatcher.
 
         ``room`` should be an object that can provide information about
@@ -51,29 +83,84 @@ class Dispatcher(object):
         `pingbot.chat.RoomParticipant`.
 
         ``tl`` should be a `RoomObserver` that can provide information about the
-        Teachers' Lounge, if desired.'''
+        Teachers' Lounge, if desired.
+
+        ``rate_limiter`` should be a `pingbot.ratelimit.RateLimiter` which is
+        checked before running each command, if desired.
+
+        ``ping_ledger`` should be a `pingbot.pingledger.PingLedger` which is
+        used to avoid pinging moderators again within its cooldown period, if
+        desired.
+
+        ``settings`` should be a `pingbot.settings.Settings`, if desired. The
+        dispatcher then creates its own rate limiter and ping ledger as the
+        settings specify, instead of using the ones given, and updates them
+        whenever the settings are reloaded, until the dispatcher is closed.'''
         self._room = room
         self._tl = tl
+        self._rate_limiter = rate_limiter
+        self._ping_ledger = ping_ledger
+        self._pings = PingStringCache(room)
+        self._profiling_admin_ids = frozenset()
+        self._follows_settings = settings is not None
+        if settings is not None:
+            self.apply_settings(settings)
+            on_settings_reload(self.apply_settings)
+
+    def close(self):
+        '''Stops following reloaded settings.'''
+        if self._follows_settings:
+            self._follows_settings = False
+            remove_on_settings_reload(self.apply_settings)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def apply_settings(self, settings):
+        '''Sets up rate limiting, the ping cooldown, and who can control the
+        profiler as given in ``settings``.'''
+        self._profiling_admin_ids = settings.profiling.admin_ids
+        rate_limits = settings.rate_limits
+        if not rate_limits.enabled:
+            self._rate_limiter = None
+        elif self._rate_limiter:
+            self._rate_limiter.set_limits(rate_limits.user_limits, rate_limits.room_limits)
+        else:
+            self._rate_limiter = RateLimiter(rate_limits.user_limits, rate_limits.room_limits)
+
+        if not settings.ping_cooldown:
+            self._ping_ledger = None
+        elif self._ping_ledger:
+            self._ping_ledger.cooldown = settings.ping_cooldown
+        else:
+            self._ping_ledger = PingLedger(settings.ping_cooldown)
 
-    def get_moderators(self, site_id, poster_id=None):
-        '''Gets information about the moderators for the given site. If poster_id
-        is provided, information about any chat user with ID equal to poster_id
-        is removed from the returned data.
+    def get_moderators(self, sites, poster_id=None):
+        '''Gets information about the moderators for the given sites, which can
+        be a single site ID or a list of sites as matched by ``SITES``. A
+        moderator of more than one of the sites is only included once. If
+        poster_id is provided, information about any chat user with ID equal to
+        poster_id is removed from the returned data.
 
         This returns a three-element tuple: first is a set of the IDs of the
         moderators, second is a list of dicts with keys for name and id, one
         dict for each moderator, and third is a boolean indicating whether a
         moderator's info has been removed from the returned information.'''
-        site_id = canonical_site_id(site_id)
-        try:
-            site_mod_info = copy.copy(moderators[site_id])
-        except KeyError as e:
-            raise UnknownSiteException(site_id)
-        else:
-            if not site_mod_info:
-                raise NoModeratorsException(site_id)
-
-        site_mod_ids = set(m['id'] for m in site_mod_info)
+        site_mod_ids = set()
+        site_mod_info = []
+        for site_id in parse_site_ids(sites):
+            mod_info = site_moderators(site_id)
+            if mod_info is None:
+                raise UnknownSiteException(site_id)
+            for m in mod_info:
+                if m['id'] not in site_mod_ids:
+                    site_mod_ids.add(m['id'])
+                    site_mod_info.append(m)
+        if not site_mod_info:
+            raise NoModeratorsException(sites)
 
         excluding_poster = False
         if poster_id is not None and poster_id in site_mod_ids:
@@ -81,7 +168,7 @@ class Dispatcher(object):
             site_mod_ids.remove(poster_id)
             excluding_poster = True
             if not site_mod_ids:
-                raise NoOtherModeratorsException(site_id, poster_id)
+                raise NoOtherModeratorsException(sites, poster_id)
 
         assert site_mod_ids
         site_mod_info.sort(key=lambda m: m['name'].lower())
@@ -90,43 +177,67 @@ class Dispatcher(object):
 
     def on_event(self, event, client):
         logger.debug('Received event: {}'.format(repr(event)))
-        if not event.type_id == MessagePosted.type_id: # I would like to get rid of this dependence on MessagePosted
+        if not event.type_id == MESSAGE_POSTED:
             return
         self.dispatch(event.content, event.message)
 
+    def parse(self, content, message):
+        '''Works out which command, if any, a message contains. Returns a tuple
+        of the command's class (one of the classes in `pingbot.ratelimit`) and
+        a function of no arguments which runs the command and returns the
+        reply, or None if the message is not a command.'''
+        poster_id = message.owner.id
+        content = content.strip()
+        if content == 'help me ping':
+            return INFO, lambda: HELP
+        elif content == 'sites':
+            return INFO, self.sites
+        m = WHOIS.match(content)
+        if m:
+            return INFO, lambda: self.whois(m.group(1), poster_id)
+        m = WHOIS_USER.match(content)
+        if m:
+            return INFO, lambda: self.whois_user(m.group(2), bool(m.group(1)))
+        m = ANYPING.match(content)
+        if m:
+            m = ANYPING.match(message.content_source)
+            return PING, lambda: self.ping_one(m.group(1), poster_id, m.group(2))
+        m = HEREPING.match(content)
+        if m:
+            m = HEREPING.match(message.content_source)
+            return PING, lambda: self.ping_present(m.group(1), poster_id, m.group(2))
+        m = ALLPING.match(content)
+        if m:
+            m = ALLPING.match(message.content_source)
+            return SUPERPING, lambda: self.ping_all(m.group(1), poster_id, m.group(2))
+        if poster_id in self._profiling_admin_ids:
+            m = PROFILE.match(content)
+            if m:
+                return ADMIN, lambda: self.profile(m.group(1))
+        return None
+
+    @profiled('dispatch')
     def dispatch(self, content, message):
         logger.debug('Dispatching message: {}'.format(content))
         try:
             def reply(m):
-                self._room.send(m, message)
-            poster_id = message.owner.id
+                if isinstance(m, str):
+                    self._room.send(m, message)
+                else:
+                    for part in m:
+                        self._room.send(part, message)
             try:
-                content = content.strip()
-                if content == 'help me ping':
-                    reply(HELP)
-                    return
-                elif content == 'sites':
-                    reply(self.sites())
-                    return
-                m = WHOIS.match(content)
-                if m:
-                    reply(self.whois(m.group(1), poster_id))
-                    return
-                m = ANYPING.match(content)
-                if m:
-                    m = ANYPING.match(message.content_source)
-                    reply(self.ping_one(m.group(1), poster_id, m.group(2)))
-                    return
-                m = HEREPING.match(content)
-                if m:
-                    m = HEREPING.match(message.content_source)
-                    reply(self.ping_present(m.group(1), poster_id, m.group(2)))
-                    return
-                m = ALLPING.match(content)
-                if m:
-                    m = ALLPING.match(message.content_source)
-                    reply(self.ping_all(m.group(1), poster_id, m.group(2)))
+                command = self.parse(content, message)
+                if command is None:
                     return
+                command_class, run = command
+                if self._rate_limiter:
+                    allowed, notice = self._rate_limiter.check(message.owner.id, command_class)
+                    if not allowed:
+                        if notice:
+                            reply(notice)
+                        return
+                reply(run())
             except:
                 logger.exception('Error dispatching message')
                 reply('Something went wrong, sorry!')
@@ -134,21 +245,38 @@ class Dispatcher(object):
             logger.exception('Error sending reply')
             self._room.send('Something went _really_ wrong, sorry!')
 
+    def profile(self, action):
+        '''Starts or stops the profiler, or gives its status.'''
+        p = profiler()
+        if p is None:
+            return 'Profiling is not configured.'
+        if action == 'on':
+            p.start()
+        elif action == 'off':
+            p.stop()
+        if p.running:
+            return 'Profiling is on, sampling every {} s and writing stacks to {} every {} s.'.format(p.interval, p.directory, p.dump_interval)
+        return 'Profiling is off.'
+
     def sites(self):
         '''Gives a list of sites.'''
-        return 'Known sites: ' + ', '.join(moderators.keys())
+        return 'Known sites: ' + ', '.join(site_ids())
 
     def whois(self, site_id, poster_id):
-        '''Gives a list of mods of the given site.'''
+        '''Gives a list of mods of the given sites.'''
+        if site_id == WILDCARD:
+            return self.NO_WILDCARD
         try:
             site_mod_ids, site_mod_info, excluding_poster = self.get_moderators(
                 site_id, poster_id
             )
-        except (UnknownSiteException, NoModeratorsException):
+        except UnknownSiteException as e:
+            return self.NO_INFO.format(e.site_id)
+        except NoModeratorsException:
             return self.NO_INFO.format(site_id)
         except NoOtherModeratorsException:
             return self.NO_OTHERS.format(site_id)
-        site_name = get_site_name(site_id)
+        site_name = get_site_names(site_id)
 
         if excluding_poster:
             count_format = '{} other'.format(len(site_mod_info))
@@ -179,36 +307,67 @@ class Dispatcher(object):
         else:
             recent_string = 'None are recently active.'
 
-        absent_mod_list = ', '.join(
-            '{} ({})'.format(m['name'], self._room.ping_string(m['id'], quote=True))
-            for m in site_mod_info if m['id'] in others
-        )
+        others_info = [m for m in site_mod_info if m['id'] in others]
+        absent_mods = [
+            '{} ({})'.format(m['name'], p)
+            for m, p in zip(others_info, self._pings.ping_strings((m['id'] for m in others_info), quote=True))
+        ]
 
         if present or recent:
             info_string = 'I know of {} moderators on {}.'.format(count_format, site_name)
             if present and recent:
+                sentences = [info_string, present_string, recent_string]
                 absent_mod_leadin = 'Others:'
-                return ' '.join([info_string, present_string, recent_string, absent_mod_leadin, absent_mod_list, '.'])
             elif present:
+                sentences = [info_string, present_string]
                 absent_mod_leadin = 'Not currently in this room:'
-                return ' '.join([info_string, present_string, absent_mod_leadin, absent_mod_list, '.'])
             elif recent:
+                sentences = [info_string, recent_string]
                 absent_mod_leadin = 'Not recently active:'
-                return ' '.join([info_string, recent_string, absent_mod_leadin, absent_mod_list, '.'])
+            if not absent_mods:
+                return ' '.join(sentences)
+            sentences.append(absent_mod_leadin)
+            return build_messages(absent_mods, prefix=' '.join(sentences) + ' ', suffix='.', separator=', ')
+        else:
+            return build_messages(
+                absent_mods,
+                prefix='I know of {} moderators on {}: '.format(count_format, site_name),
+                suffix='. None are recently active.',
+                separator=', '
+            )
+
+    def whois_user(self, user, by_id=False):
+        '''Gives a list of the sites moderated by the given user. ``user`` is
+        a name as it would be used in a ping, or a user ID if ``by_id`` is true.'''
+        if by_id:
+            try:
+                info = moderator_info(int(user))
+            except ValueError:
+                info = None
+            mod_infos = [info] if info else []
         else:
-            return 'I know of {} moderators on {}: {}. None are recently active.'.format(
-                count_format,
-                site_name,
-                absent_mod_list
+            mod_infos = find_moderators(user)
+
+        if not mod_infos:
+            return 'I don\'t know of any moderator {}.'.format(user)
+        return ' '.join(
+            '{} ({}) is a moderator on {}.'.format(
+                info.name,
+                info.id,
+                ', '.join(site_display_name(s) for s in info.sites)
             )
+            for info in mod_infos
+        )
 
     def ping_one(self, site_id, poster_id, message=None):
-        '''Sends a ping to one mod from the chosen site.'''
+        '''Sends a ping to one mod from the chosen sites.'''
         try:
             site_mod_ids, site_mod_info, excluding_poster = self.get_moderators(
                 site_id, poster_id
             )
-        except (UnknownSiteException, NoModeratorsException):
+        except UnknownSiteException as e:
+            return self.NO_INFO.format(e.site_id)
+        except NoModeratorsException:
             return self.NO_INFO.format(site_id)
         except NoOtherModeratorsException:
             return self.NO_OTHERS.format(site_id)
@@ -240,90 +399,214 @@ class Dispatcher(object):
             shuffle_key = random.random()
             return (score, shuffle_key)
 
-        mod_ping = self._room.ping_string(min(mod_ping_set, key=activity_metric))
+        recent = self._recently_pinged(site_id, site_mod_ids)
+        if recent:
+            return self._already_pinged(recent, site_mod_info)
+
+        mod_ping_id = min(mod_ping_set, key=activity_metric)
+        self._record_pings(site_id, [mod_ping_id])
+        mod_ping = self._pings.ping_string(mod_ping_id)
         if message:
             return '{}: {}'.format(mod_ping, message)
         else:
             return 'Pinging one moderator: {}'.format(mod_ping)
 
     def ping_present(self, site_id, poster_id, message=None):
-        '''Sends a ping to all currently present mods from the chosen site.'''
+        '''Sends a ping to all currently present mods from the chosen sites.'''
         try:
             site_mod_ids, site_mod_info, excluding_poster = self.get_moderators(
                 site_id, poster_id
             )
-        except (UnknownSiteException, NoModeratorsException):
+        except UnknownSiteException as e:
+            return self.NO_INFO.format(e.site_id)
+        except NoModeratorsException:
             return self.NO_INFO.format(site_id)
         except NoOtherModeratorsException:
             return self.NO_OTHERS.format(site_id)
 
-        site_name = get_site_name(site_id)
+        site_name = get_site_names(site_id)
 
         present, pingable, absent = self._room.classify_user_ids(site_mod_ids)
 
+        recent = self._recently_pinged(site_id, present)
+        if recent:
+            present = present - set(recent)
+            if not present:
+                return self._already_pinged(recent, site_mod_info)
+
         if present:
-            mod_pings = ' '.join(self._room.ping_strings(present))
-            if message:
-                return '{}: {}'.format(mod_pings, message)
-            else:
-                return 'Pinging {} moderator{}: {}'.format(len(present), 's' if len(present) != 1 else '', mod_pings)
+            self._record_pings(site_id, present)
+            return self._ping_messages(
+                present,
+                'Pinging {} moderator{}: '.format(len(present), 's' if len(present) != 1 else ''),
+                message,
+                self._already_pinged(recent, site_mod_info) + ' ' if recent else ''
+            )
         else:
             return ('No other' if excluding_poster else 'No') + ' moderators of {} are currently in this room. Use `{} mod` to ping one.'.format(site_name, site_id)
 
     def ping_all(self, site_id, poster_id, message=None):
-        '''Sends a ping to all mods from the chosen site.'''
+        '''Sends a ping to all mods from the chosen sites.'''
+        if site_id == WILDCARD:
+            return self.NO_WILDCARD
         try:
             site_mod_ids, site_mod_info, excluding_poster = self.get_moderators(
                 site_id, poster_id
             )
-        except (UnknownSiteException, NoModeratorsException):
+        except UnknownSiteException as e:
+            return self.NO_INFO.format(e.site_id)
+        except NoModeratorsException:
             return self.NO_INFO.format(site_id)
         except NoOtherModeratorsException:
             return self.NO_OTHERS.format(site_id)
 
-        mod_pings = ' '.join(self._room.ping_strings(m['id'] for m in site_mod_info))
+        recent = self._recently_pinged(site_id, site_mod_ids)
+        mod_ping_ids = [m['id'] for m in site_mod_info if m['id'] not in recent]
+        if not mod_ping_ids:
+            return self._already_pinged(recent, site_mod_info)
+
+        self._record_pings(site_id, mod_ping_ids)
+        return self._ping_messages(
+            mod_ping_ids,
+            'Pinging {} moderators: '.format(len(mod_ping_ids)),
+            message,
+            self._already_pinged(recent, site_mod_info) + ' ' if recent else ''
+        )
+
+    def _ping_messages(self, user_ids, leadin, message=None, note=''):
+        '''Builds the messages that ping the given users, starting with ``note``.
+        If there is a ``message`` it goes after the pings, otherwise ``leadin``
+        goes before them.'''
+        mod_pings = self._pings.ping_strings(user_ids)
         if message:
-            return '{}: {}'.format(mod_pings, message)
+            return build_messages(mod_pings, prefix=note, suffix=': ' + message)
         else:
-            return 'Pinging {} moderators: {}'.format(len(site_mod_info), mod_pings)
+            return build_messages(mod_pings, prefix=note + leadin)
+
+    def _ping_ledger_keys(self, site_id, user_ids):
+        '''Yields a (site ID, user ID) pair for each of the given users and each
+        of the given sites that they moderate.'''
+        site_ids = set(parse_site_ids(site_id))
+        for user_id in user_ids:
+            info = moderator_info(user_id)
+            if info:
+                for s in info.sites:
+                    if s in site_ids:
+                        yield (s, user_id)
+
+    def _recently_pinged(self, site_id, user_ids):
+        if not self._ping_ledger:
+            return {}
+        return self._ping_ledger.recently_pinged(self._ping_ledger_keys(site_id, user_ids))
+
+    def _record_pings(self, site_id, user_ids):
+        if self._ping_ledger:
+            self._ping_ledger.record(self._ping_ledger_keys(site_id, user_ids))
+
+    def _already_pinged(self, recent, site_mod_info):
+        now = time.time()
+        return 'Already pinged {}.'.format(', '.join(
+            '{} {} ago'.format(m['name'], format_elapsed(now - recent[m['id']]))
+            for m in site_mod_info if m['id'] in recent
+        ))
 
-def _listen_to_room(room, tl=None):
+def _listen_to_room(room, tl=None, dispatcher_options=None):
     try:
-        dp = Dispatcher(room, tl)
-        room.watch(dp.on_event)
-        while room.observer_active:
-            # wait for an interruption
-            time.sleep(1)
+        with Dispatcher(room, tl, **(dispatcher_options or {})) as dp:
+            room.watch(dp.on_event)
+            while room.observer_active:
+                # wait for an interruption
+                time.sleep(1)
     except KeyboardInterrupt:
         logger.info('Terminating due to KeyboardInterrupt')
 
-from pingbot.chat import intersection
-
-def listen_to_chat_room(email, password, room_id, watch_tl=False, host='stackexchange.com', **kwargs):
+def listen_to_chat_room(email, password, room_id, watch_tl=False, host='stackexchange.com', dispatcher_options=None, tl_feed=None, **kwargs):
     from pingbot.chat.stackexchange import ChatExchangeSession, RoomObserver, RoomParticipant
     with ChatExchangeSession(email, password, host) as ce:
-        if watch_tl:
+        if watch_tl and tl_feed:
+            from pingbot.chat.feed import FeedObserver
+            with FeedObserver(path=tl_feed) as tl:
+                with RoomParticipant(ce, room_id, **kwargs) as room:
+                    _listen_to_room(room, tl, dispatcher_options)
+        elif watch_tl:
             if host != 'stackexchange.com':
                 raise ValueError('Can\'t connect to Teachers\' Lounge on host {}'.format(host))
             # Teachers' Lounge room ID is 4
             with RoomObserver(ce, 4, **kwargs) as tl:
                 with RoomParticipant(ce, room_id, **kwargs) as room:
-                    _listen_to_room(room, tl)
+                    _listen_to_room(room, tl, dispatcher_options)
         else:
             with RoomParticipant(ce, room_id, **kwargs) as room:
-                _listen_to_room(room)
+                _listen_to_room(room, None, dispatcher_options)
+
+def listen_to_chat_rooms(email, password, room_ids, tl=None, host='stackexchange.com', dispatcher_options=None, room_options=None, **kwargs):
+    '''Listens to several chat rooms with one login, each with its own
+    `Dispatcher`, until all of them close. ``tl`` is an already open observer
+    of the Teachers' Lounge, if desired. ``room_options`` maps room IDs to
+    extra keyword arguments for those rooms.'''
+    from pingbot.chat.stackexchange import ChatExchangeSession, RoomParticipant
+    room_options = room_options or {}
+    with ChatExchangeSession(email, password, host) as ce:
+        with contextlib.ExitStack() as stack:
+            rooms = []
+            for room_id in room_ids:
+                room = stack.enter_context(RoomParticipant(ce, room_id, **dict(kwargs, **room_options.get(room_id, {}))))
+                dp = stack.enter_context(Dispatcher(room, tl, **(dispatcher_options or {})))
+                room.watch(dp.on_event)
+                rooms.append(room)
+            try:
+                while any(room.observer_active for room in rooms):
+                    # wait for an interruption
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                logger.info('Terminating due to KeyboardInterrupt')
 
-def listen_to_terminal_room(watch_tl=False, **kwargs):
-    from pingbot.chat.stackexchange import ChatExchangeSession, RoomObserver
+_TERMINAL_ROOM_OPTIONS = ('leave_room_on_close', 'ping_format', 'superping_format', 'user_id', 'present_user_ids', 'pingable_user_ids', 'input', 'output')
+
+def listen_to_terminal_room(watch_tl=False, dispatcher_options=None, tl_feed=None, **kwargs):
     from pingbot.chat.terminal import Room as TerminalRoom
-    if watch_tl:
+    term_kwargs = intersection(kwargs, _TERMINAL_ROOM_OPTIONS)
+    if watch_tl and tl_feed:
+        from pingbot.chat.feed import FeedObserver
+        with FeedObserver(path=tl_feed) as tl:
+            with TerminalRoom(**term_kwargs) as room:
+                _listen_to_room(room, tl, dispatcher_options)
+    elif watch_tl:
+        # Only load ChatExchange when actually connecting to chat
+        from pingbot.chat.stackexchange import ChatExchangeSession, RoomObserver
         with ChatExchangeSession(kwargs['email'], kwargs['password'], 'stackexchange.com') as ce:
             # Teachers' Lounge room ID is 4
             se_kwargs = intersection(kwargs, ('chatexchange_session', 'room_id', 'leave_room_on_close', 'ping_format', 'superping_format'))
-            term_kwargs = intersection(kwargs, ('leave_room_on_close', 'ping_format', 'superping_format', 'present_user_ids', 'pingable_user_ids'))
             with RoomObserver(ce, 4, **se_kwargs) as tl:
                 with TerminalRoom(**term_kwargs) as room:
-                    _listen_to_room(room, tl)
+                    _listen_to_room(room, tl, dispatcher_options)
     else:
-        with TerminalRoom(**kwargs) as room:
-            _listen_to_room(room)
+        with TerminalRoom(**term_kwargs) as room:
+            _listen_to_room(room, None, dispatcher_options)
+
+def _serve_feed(observer, path):
+    from pingbot.chat.feed import FeedPublisher, FeedServer
+    try:
+        with FeedServer(FeedPublisher(observer), path):
+            while observer.observer_active:
+                # wait for an interruption
+                time.sleep(1)
+    except KeyboardInterrupt:
+        logger.info('Terminating due to KeyboardInterrupt')
+
+def serve_tl_feed(email, password, path, host='stackexchange.com', **kwargs):
+    '''Watches the Teachers' Lounge and publishes its activity on a Unix socket
+    at ``path``, so that any number of bots on this machine can use it (by
+    passing ``tl_feed``) instead of each joining the Teachers' Lounge.'''
+    from pingbot.chat.stackexchange import ChatExchangeSession, RoomObserver
+    with ChatExchangeSession(email, password, host) as ce:
+        # Teachers' Lounge room ID is 4
+        with RoomObserver(ce, 4, **kwargs) as tl:
+            _serve_feed(tl, path)
+
+def serve_terminal_feed(path, **kwargs):
+    '''Publishes the activity of a terminal room on a Unix socket at ``path``,
+    as a local stand-in for the Teachers' Lounge feed when testing.'''
+    from pingbot.chat.terminal import Room as TerminalRoom
+    with TerminalRoom(**intersection(kwargs, _TERMINAL_ROOM_OPTIONS)) as room:
+        _serve_feed(room, path)
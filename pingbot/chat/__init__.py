@@ -1,5 +1,25 @@
+import collections
 from abc import ABCMeta, abstractmethod, abstractproperty
 
+# An immutable snapshot of who is in a room. ``version`` increases each time
+# the membership changes; ``present_user_ids`` and ``pingable_user_ids`` are
+# frozensets and ``user_names`` maps pingable user IDs to names.
+Membership = collections.namedtuple('Membership', ['version', 'present_user_ids', 'pingable_user_ids', 'user_names'])
+
+# The type IDs of message and user status events, the same as those of
+# ChatExchange.chatexchange.events.MessagePosted, UserEntered, and UserLeft,
+# which are defined here so that handling events doesn't require importing
+# ChatExchange
+MESSAGE_POSTED = 1
+USER_ENTERED = 3
+USER_LEFT = 4
+
+def format_message(message):
+    return ('[auto]\n{}' if '\n' in message else '[auto] {}').format(message)
+
+def code_quote(s):
+    return '`{}`'.format(s.replace('`', ''))
+
 def intersection(collection, pool):
     pool = set(pool)
     if isinstance(collection, frozenset):
@@ -63,6 +83,13 @@ class RoomObserver(object, metaclass=ABCMeta):
         superpings). This _should_ be a superset of ``present_user_ids``.'''
         pass
 
+    @property
+    def membership_version(self):
+        '''Return a number which changes whenever ``present_user_ids`` or
+        ``pingable_user_ids`` changes, or None if the implementation doesn't
+        keep track.'''
+        return None
+
     @abstractproperty
     def observer_active(self):
         return True
@@ -0,0 +1,357 @@
+import json
+import logging
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+
+from pingbot.profiling import profiled
+from . import MESSAGE_POSTED, USER_ENTERED, USER_LEFT, Membership, RoomObserver as BaseRoomObserver
+
+logger = logging.getLogger('pingbot.chat.feed')
+
+# The feed is a stream of lines of JSON, each an object with one or both of
+# the keys
+#  - "activity": an object mapping user IDs to the time of their last activity
+#  - "membership": an object with keys "present" and "pingable", each a list
+#    of user IDs
+# A new subscriber first receives a line with the full activity record and
+# membership, and after that, lines with changes as they happen.
+
+def encode_update(activity=None, membership=None):
+    update = {}
+    if activity:
+        update['activity'] = {str(k): v for k, v in activity.items()}
+    if membership is not None:
+        update['membership'] = {
+            'present': sorted(membership[0]),
+            'pingable': sorted(membership[1])
+        }
+    return (json.dumps(update, separators=(',', ':')) + '\n').encode('UTF-8')
+
+class _Subscriber(object):
+    '''A subscriber socket with its own queue of updates and a thread which
+    sends them, so that a slow subscriber can't hold up the observed room or
+    the other subscribers.'''
+    def __init__(self, sock, on_failure, queue_size, send_timeout):
+        self.sock = sock
+        self._on_failure = on_failure
+        self._updates = queue.Queue(maxsize=queue_size)
+        sock.settimeout(send_timeout)
+        self._thread = threading.Thread(target=self._send)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, data):
+        '''Queues ``data`` to be sent. Returns False if the queue is full.'''
+        try:
+            self._updates.put_nowait(data)
+        except queue.Full:
+            return False
+        return True
+
+    def stop(self):
+        '''Stops sending once the updates already queued have been sent.'''
+        try:
+            self._updates.put_nowait(None)
+        except queue.Full:
+            # the sender is stuck anyway; it stops when its send fails
+            pass
+
+    def _send(self):
+        while True:
+            data = self._updates.get()
+            if data is None:
+                return
+            try:
+                self.sock.sendall(data)
+            except OSError as e:
+                self._on_failure(self, 'send failed: {}'.format(e))
+                return
+
+class FeedPublisher(object):
+    '''Publishes the user activity and membership of an observed room to any
+    number of subscribers, which are connected sockets.
+
+    Activity is published as the observer's events arrive. Membership changes
+    that don't come with an event (such as the periodic refresh from the
+    server) are picked up by checking the observer's membership version every
+    ``membership_interval`` seconds.
+
+    Each subscriber has a queue of up to ``queue_size`` updates waiting to be
+    sent. A subscriber which lets its queue fill up, or doesn't accept an
+    update within ``send_timeout`` seconds, is dropped and its socket closed,
+    so that one stopped subscriber can't hold up the rest.'''
+    def __init__(self, observer, membership_interval=30, queue_size=1000, send_timeout=10):
+        self._observer = observer
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._queue_size = queue_size
+        self._send_timeout = send_timeout
+        # Start from whatever activity the observer already knows about
+        user_activity = getattr(observer, 'user_activity', None)
+        self._activity = user_activity() if user_activity else {}
+        # New subscribers get the current membership, so it only needs to be
+        # published again once the version changes
+        self._membership_version = observer.membership_version
+        self._membership_interval = membership_interval
+        self._closing = threading.Event()
+        observer.watch(self._on_event)
+        self._membership_thread = threading.Thread(target=self._check_membership_periodically)
+        self._membership_thread.daemon = True
+        self._membership_thread.start()
+
+    def _current_membership(self):
+        return (self._observer.present_user_ids, self._observer.pingable_user_ids)
+
+    def add_subscriber(self, sock):
+        '''Sends the full state to ``sock`` and adds it to the subscribers.'''
+        with self._lock:
+            subscriber = _Subscriber(sock, self._drop, self._queue_size, self._send_timeout)
+            subscriber.put(encode_update(self._activity, self._current_membership()))
+            self._subscribers.append(subscriber)
+        logger.info('Added feed subscriber ({} total)'.format(len(self._subscribers)))
+
+    def remove_subscriber(self, sock):
+        '''Stops publishing to ``sock``, without closing it.'''
+        with self._lock:
+            for subscriber in self._subscribers:
+                if subscriber.sock is sock:
+                    self._subscribers.remove(subscriber)
+                    subscriber.stop()
+                    logger.info('Removed feed subscriber ({} remaining)'.format(len(self._subscribers)))
+                    break
+
+    def _drop(self, subscriber, reason):
+        with self._lock:
+            self._discard(subscriber, reason)
+
+    def _discard(self, subscriber, reason):
+        # must be called with the lock held
+        try:
+            self._subscribers.remove(subscriber)
+        except ValueError:
+            return
+        logger.warning('Dropping feed subscriber ({}), {} remaining'.format(reason, len(self._subscribers)))
+        subscriber.stop()
+        try:
+            subscriber.sock.close()
+        except OSError:
+            pass
+
+    def _publish(self, activity=None, membership=None):
+        data = encode_update(activity, membership)
+        for subscriber in list(self._subscribers):
+            if not subscriber.put(data):
+                self._discard(subscriber, 'too far behind')
+
+    @profiled('feed')
+    def _on_event(self, event, client):
+        if event.type_id not in (MESSAGE_POSTED, USER_ENTERED, USER_LEFT):
+            return
+        user = getattr(event, 'user', None)
+        user_id = user.id if user is not None else event.message.owner.id
+        time_stamp = getattr(event, 'time_stamp', None) or time.time()
+        with self._lock:
+            self._activity[user_id] = time_stamp
+            self._publish(activity={user_id: time_stamp}, membership=self._membership_if_changed())
+
+    def _membership_if_changed(self):
+        version = self._observer.membership_version
+        if version is not None and version == self._membership_version:
+            return None
+        self._membership_version = version
+        return self._current_membership()
+
+    def _check_membership_periodically(self):
+        while not self._closing.wait(self._membership_interval):
+            with self._lock:
+                membership = self._membership_if_changed()
+                if membership is not None:
+                    self._publish(membership=membership)
+
+    def close(self):
+        '''Stops publishing. Subscriber sockets are left open, so they can be
+        given to another publisher.'''
+        self._closing.set()
+        with self._lock:
+            for subscriber in self._subscribers:
+                subscriber.stop()
+            del self._subscribers[:]
+
+class FeedServer(object):
+    '''Listens on a Unix socket at ``path`` and subscribes each connection to
+    ``publisher``, so that any number of local processes can follow one
+    observed room.'''
+    def __init__(self, publisher, path):
+        self.publisher = publisher
+        self.path = path
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            # left over from a previous run
+            os.unlink(path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        self._listener.listen(16)
+        # so that the accepting thread notices when the server is closed
+        self._listener.settimeout(1)
+        self._connections = []
+        self._active = True
+        self._accept_thread = threading.Thread(target=self._accept)
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+        logger.info('Serving feed on {}'.format(path))
+
+    def _accept(self):
+        while self._active:
+            try:
+                conn, address = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                if self._active:
+                    logger.exception('Error accepting feed connection')
+                break
+            conn.shutdown(socket.SHUT_RD)
+            # forget connections which the publisher has dropped
+            self._connections = [c for c in self._connections if c.fileno() != -1]
+            self._connections.append(conn)
+            self.publisher.add_subscriber(conn)
+
+    def close(self):
+        if not self._active:
+            return
+        self._active = False
+        self.publisher.close()
+        self._listener.close()
+        for conn in self._connections:
+            try:
+                conn.close()
+            except OSError:
+                pass
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        logger.info('Stopped serving feed on {}'.format(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+class FeedObserver(BaseRoomObserver):
+    '''A RoomObserver that gets the user activity and membership of a room from
+    a feed published by a `FeedPublisher`, instead of connecting to the room
+    itself. It doesn't receive the room's events, so it can't be watched or
+    iterated over; it's meant to stand in for the Teachers' Lounge observer
+    given to a `pingbot.Dispatcher`.
+
+    The feed is read either from ``sock``, an already connected socket, or
+    from the Unix socket of a `FeedServer` at ``path``. In the latter case, if
+    the connection is lost, the observer keeps reconnecting every
+    ``reconnect_interval`` seconds, keeping the last known state meanwhile.'''
+    def __init__(self, sock=None, path=None, superping_format='@@{}', reconnect_interval=15):
+        if (sock is None) == (path is None):
+            raise ValueError('Exactly one of sock and path must be given')
+        self._sock = sock
+        self.path = path
+        self.superping_format = str(superping_format)
+        self.reconnect_interval = reconnect_interval
+        self._user_last_activity = {}
+        self._membership = Membership(0, frozenset(), frozenset(), {})
+        self._observer_active = True
+        self._closing = threading.Event()
+        self._reader_thread = threading.Thread(target=self._read_path if path else self._read)
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
+
+    def _read(self):
+        try:
+            self._read_socket()
+        finally:
+            self._observer_active = False
+
+    def _read_path(self):
+        while not self._closing.is_set():
+            try:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.connect(self.path)
+            except OSError as e:
+                logger.warning('Unable to connect to feed at {}: {}'.format(self.path, e))
+            else:
+                logger.info('Connected to feed at {}'.format(self.path))
+                self._read_socket()
+            self._closing.wait(self.reconnect_interval)
+
+    def _read_socket(self):
+        try:
+            with self._sock.makefile('r', encoding='UTF-8') as f:
+                for line in f:
+                    self._apply(json.loads(line))
+        except (OSError, ValueError):
+            if not self._closing.is_set():
+                logger.exception('Error reading feed')
+        finally:
+            logger.info('Feed closed')
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+
+    def _apply(self, update):
+        activity = update.get('activity')
+        if activity:
+            self._user_last_activity.update((int(k), v) for k, v in activity.items())
+        membership = update.get('membership')
+        if membership is not None:
+            self._membership = Membership(
+                self._membership.version + 1,
+                frozenset(membership['present']),
+                frozenset(membership['pingable']),
+                {}
+            )
+
+    def user_last_activity(self, user_id):
+        return self._user_last_activity.get(user_id, 0)
+
+    def watch(self, event_callback):
+        raise NotImplementedError('Events are not available from a feed')
+
+    def __iter__(self):
+        raise NotImplementedError('Events are not available from a feed')
+
+    def ping_string(self, user_id, quote=False):
+        return self.superping_format.format(user_id)
+
+    def ping_strings(self, user_ids, quote=False):
+        return [self.ping_string(u, quote) for u in user_ids]
+
+    @property
+    def membership_version(self):
+        return self._membership.version
+
+    @property
+    def present_user_ids(self):
+        return self._membership.present_user_ids
+
+    @property
+    def pingable_user_ids(self):
+        return self._membership.pingable_user_ids
+
+    @property
+    def observer_active(self):
+        return self._observer_active
+
+    def close(self):
+        if not self._observer_active:
+            return
+        self._observer_active = False
+        self._closing.set()
+        try:
+            if self._sock is not None:
+                self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
@@ -3,16 +3,15 @@ import logging
 import json
 import random
 import re
+import threading
 import time
 import ChatExchange.chatexchange as ce
 
-from . import RoomObserver as BaseRoomObserver, RoomParticipant as BaseRoomParticipant
+from pingbot.profiling import profiled
+from . import Membership, RoomObserver as BaseRoomObserver, RoomParticipant as BaseRoomParticipant, format_message, code_quote
 
 logger = logging.getLogger('pingbot.chat.stackexchange')
 
-def format_message(message):
-    return ('[auto]\n{}' if '\n' in message else '[auto] {}').format(message)
-
 class ChatExchangeSession(object):
     def __init__(self, email, password, host='stackexchange.com'):
         self.client = ce.client.Client(host, email, password)
@@ -22,25 +21,65 @@ class ChatExchangeSession(object):
     def __exit__(self, exc_type, exc_value, exc_traceback):
         self.client.logout()
 
-def code_quote(s):
-    return '`{}`'.format(s.replace('`', ''))
+def _apply_membership_event(membership, entered=None, left=None):
+    '''Returns ``membership`` updated for the user ``entered`` entering the
+    room or the user ``left`` leaving it, or ``membership`` itself if that
+    changes nothing.'''
+    present = membership.present_user_ids
+    pingable = membership.pingable_user_ids
+    user_names = membership.user_names
+    if entered is not None:
+        if entered.id in present and user_names.get(entered.id) == entered.name:
+            return membership
+        present = present | {entered.id}
+        pingable = pingable | {entered.id}
+        user_names = dict(user_names)
+        user_names[entered.id] = entered.name
+    if left is not None:
+        if left.id not in present:
+            return membership
+        # users who leave stay pingable for a while, until the next refresh
+        # from the server drops them
+        present = present - {left.id}
+    return Membership(membership.version + 1, present, pingable, user_names)
 
 class RoomObserver(BaseRoomObserver):
-    def __init__(self, chatexchange_session, room_id, leave_room_on_close=True, ping_format='@{}', superping_format='@@{}'):
+    '''A RoomObserver for a Stack Exchange chat room.
+
+    The sets of present and pingable users are kept as an immutable
+    `Membership` snapshot, which is updated from UserEntered and UserLeft
+    events as they arrive and replaced with a full list fetched from the
+    server every ``membership_refresh_interval`` seconds, to correct for
+    anything the events missed (such as users who stop being pingable). Reading
+    the present or pingable user IDs never goes to the network.'''
+    def __init__(self, chatexchange_session, room_id, leave_room_on_close=True, ping_format='@{}', superping_format='@@{}', membership_refresh_interval=300):
         self._observer_active = False
         self._user_last_activity = {}
         self._room = None
+        self._membership = Membership(0, frozenset(), frozenset(), {})
+        self._membership_lock = threading.Lock()
+        # While a refresh is fetching the membership from the server, the
+        # UserEntered and UserLeft events that arrive are recorded here, to be
+        # applied again to the fetched lists
+        self._membership_events = None
+        self._closing = threading.Event()
         self.session = chatexchange_session
         self.room_id = room_id
         self.leave_room_on_close = leave_room_on_close
         self.ping_format = str(ping_format)
         self.superping_format = str(superping_format)
+        self.membership_refresh_interval = membership_refresh_interval
         self._room = self.session.client.get_room(self.room_id)
         self._room.join()
-        self.watch(self._user_status_callback)
         self._observer_active = True
+        self.watch(self._user_status_callback)
+        self.refresh_membership()
+        self._refresh_thread = threading.Thread(target=self._refresh_membership_periodically)
+        self._refresh_thread.daemon = True
+        self._refresh_thread.start()
         logger.info('Joined room {}'.format(room_id))
 
+    @profiled('transport')
     def _user_status_callback(self, event, client):
         if event.type_id in (
             ce.events.UserEntered.type_id,
@@ -48,10 +87,61 @@ class RoomObserver(BaseRoomObserver):
             ce.events.MessagePosted.type_id
         ):
             self._user_last_activity[event.user.id] = event.time_stamp
+        if event.type_id == ce.events.UserEntered.type_id:
+            self._update_membership(entered=event.user)
+        elif event.type_id == ce.events.UserLeft.type_id:
+            self._update_membership(left=event.user)
+
+    def _update_membership(self, entered=None, left=None):
+        with self._membership_lock:
+            if self._membership_events is not None:
+                self._membership_events.append((entered, left))
+            self._membership = _apply_membership_event(self._membership, entered, left)
+
+    def refresh_membership(self):
+        '''Replaces the membership snapshot with the current lists of present and
+        pingable users from the server. Users who enter or leave while the lists
+        are being fetched are accounted for, whether or not the lists include
+        them.'''
+        with self._membership_lock:
+            self._membership_events = []
+        try:
+            present = frozenset(self._room.get_current_user_ids())
+            pingable_ids = self._room.get_pingable_user_ids()
+            user_names = dict(zip(pingable_ids, self._room.get_pingable_user_names()))
+        except:
+            with self._membership_lock:
+                self._membership_events = None
+            raise
+        # present users are always pingable
+        pingable = frozenset(pingable_ids) | present
+        with self._membership_lock:
+            events, self._membership_events = self._membership_events, None
+            old = self._membership
+            new = Membership(old.version, present, pingable, user_names)
+            # entering and leaving are idempotent, so applying an event again
+            # is harmless if the server had already seen it
+            for entered, left in events:
+                new = _apply_membership_event(new, entered, left)
+            if (new.present_user_ids, new.pingable_user_ids, new.user_names) != (old.present_user_ids, old.pingable_user_ids, old.user_names):
+                self._membership = new._replace(version=old.version + 1)
+        logger.debug('Refreshed membership of room {}: {} present, {} pingable'.format(self.room_id, len(present), len(pingable)))
+
+    def _refresh_membership_periodically(self):
+        while not self._closing.wait(self.membership_refresh_interval):
+            try:
+                self.refresh_membership()
+            except:
+                logger.exception('Error refreshing membership of room {}'.format(self.room_id))
 
     def user_last_activity(self, user_id):
         return self._user_last_activity.get(user_id, 0)
 
+    def user_activity(self):
+        '''Returns a dict mapping the ID of each user seen in the room to the
+        time of their last activity.'''
+        return dict(self._user_last_activity)
+
     def watch(self, event_callback):
         if self._observer_active:
             self._room.watch(event_callback)
@@ -72,6 +162,7 @@ class RoomObserver(BaseRoomObserver):
         if not self._observer_active:
             return
         self._observer_active = False
+        self._closing.set()
         logger.debug('Closing RoomObserver')
         try:
             if self.leave_room_on_close:
@@ -93,16 +184,24 @@ class RoomObserver(BaseRoomObserver):
     def ping_strings(self, user_ids, quote=False):
         ping_format = code_quote(self.ping_format) if quote else self.ping_format
         superping_format = code_quote(self.superping_format) if quote else self.superping_format
-        pingable_users = dict(list(zip(self._room.get_pingable_user_ids(), self._room.get_pingable_user_names())))
+        pingable_users = self._membership.user_names
         return [(ping_format.format(pingable_users[i].replace(' ', '')) if i in pingable_users else superping_format.format(i)) for i in user_ids]
 
+    @property
+    def membership(self):
+        return self._membership
+
+    @property
+    def membership_version(self):
+        return self._membership.version
+
     @property
     def present_user_ids(self):
-        return set(self._room.get_current_user_ids())
+        return self._membership.present_user_ids
 
     @property
     def pingable_user_ids(self):
-        return set(self._room.get_pingable_user_ids())
+        return self._membership.pingable_user_ids
 
     @property
     def observer_active(self):
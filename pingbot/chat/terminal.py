@@ -1,18 +1,14 @@
+import codecs
 import collections
-import io
 import logging
-import json
 import queue
-import random
-import re
 import sys
 import threading
 import time
-import ChatExchange.chatexchange as ce
 
-from pingbot.chat.stackexchange import format_message, code_quote
-from pingbot.moderators import moderators
-from . import RoomObserver as BaseRoomObserver, RoomParticipant as BaseRoomParticipant
+from pingbot.moderators import generation as moderator_generation, moderator_info
+from pingbot.profiling import profiled
+from . import MESSAGE_POSTED, RoomObserver as BaseRoomObserver, RoomParticipant as BaseRoomParticipant, format_message, code_quote
 
 logger = logging.getLogger('pingbot.chat.terminal')
 
@@ -25,7 +21,7 @@ class TerminalMessage(object):
 
 # Analogous to chatexchange.event.MessagePosted
 class TerminalReadEvent(object):
-    type_id = 1 # matches MessagePosted.type_id
+    type_id = MESSAGE_POSTED
     def __init__(self, user_id, message_id, content):
         self.content = content
         self.message = TerminalMessage(user_id, message_id, content)
@@ -47,12 +43,26 @@ class TerminalEventIterable(object):
 
 class Room(BaseRoomObserver, BaseRoomParticipant):
     '''A RoomObserver for a simple terminal-based chat room. This implements
-    a basic minimum of functionality: it reads lines from stdin and interprets
-    them as posted messages. It also includes dummy implementations of the methods
-    that check for current or pingable users, but its sense of who is in the room
-    and who is pingable is a static list, set on initialization.'''
-    def __init__(self, leave_room_on_close=True, ping_format='@{}', superping_format='@@{}', user_id=0, present_user_ids=frozenset(), pingable_user_ids=frozenset()):
+    a basic minimum of functionality: it reads lines from stdin (or another
+    binary stream) and interprets them as posted messages. It also includes
+    dummy implementations of the methods that check for current or pingable
+    users, but its sense of who is in the room and who is pingable is a static
+    list, set on initialization.
+
+    Input is read in chunks by one thread, which splits it into lines and
+    queues them in batches, and a second thread takes the batches off the queue
+    and invokes the callbacks. This lets a piped input file be consumed as fast
+    as the callbacks can handle it.'''
+    READ_CHUNK_SIZE = 65536
+    # Limit on batches waiting to be dispatched. When the queue is full, the
+    # reading thread waits, so at most this many chunks of input are held in
+    # memory as events.
+    MAX_QUEUED_BATCHES = 16
+
+    def __init__(self, leave_room_on_close=True, ping_format='@{}', superping_format='@@{}', user_id=0, present_user_ids=frozenset(), pingable_user_ids=frozenset(), output=None, input=None):
         self.leave_room_on_close = leave_room_on_close
+        self.output = output or sys.stdout
+        self.input = input or sys.stdin.buffer
         self.ping_format = str(ping_format)
         self.superping_format = str(superping_format)
         self.user_id = user_id
@@ -63,25 +73,86 @@ class Room(BaseRoomObserver, BaseRoomParticipant):
         if not (self._present_user_ids < self._pingable_user_ids):
             logger.warning('Present user IDs not a subset of pingable user IDs (may be valid for testing)')
         self._callbacks = []
+        # Each item in the queue is a list of events read from one chunk of
+        # input, or None to mark the end of the input
+        self._event_batches = queue.Queue(maxsize=self.MAX_QUEUED_BATCHES)
         self._input_thread = threading.Thread(target=self._read)
         self._input_thread.daemon = True
+        self._dispatch_thread = threading.Thread(target=self._dispatch)
+        self._dispatch_thread.daemon = True
+        self._threads_started = False
         self._observer_active = True
         logger.info('Joined fake terminal room')
         self.send('Ping bot is now active')
 
+    def _read_chunks(self):
+        read = getattr(self.input, 'read1', self.input.read)
+        while True:
+            chunk = read(self.READ_CHUNK_SIZE)
+            if not chunk:
+                # b'' or '' both mean end of input
+                return
+            yield chunk
+
     def _read(self):
+        decoder = codecs.getincrementaldecoder('UTF-8')(errors='replace')
+        line_id = 0
+        partial_line = ''
         try:
-            for line_id, line in enumerate(iter(sys.stdin.readline, b'')):
-                logger.debug('Read input line {}: {}'.format(line_id, line.rstrip('\n')))
-                if self._observer_active:
-                    self._invoke_callbacks(TerminalReadEvent(self.user_id, line_id, line))
-                else:
+            for chunk in self._read_chunks():
+                if not self._observer_active:
                     # In case room is closed from another thread
+                    return
+                if isinstance(chunk, bytes):
+                    chunk = decoder.decode(chunk)
+                lines = (partial_line + chunk).split('\n')
+                partial_line = lines.pop()
+                batch = []
+                for line in lines:
+                    batch.append(TerminalReadEvent(self.user_id, line_id, line.rstrip('\r')))
+                    line_id += 1
+                if batch:
+                    logger.debug('Read input lines {} to {}'.format(line_id - len(batch), line_id - 1))
+                    if not self._put_batch(batch):
+                        return
+            partial_line += decoder.decode(b'', final=True)
+            if partial_line:
+                self._put_batch([TerminalReadEvent(self.user_id, line_id, partial_line.rstrip('\r'))])
+            logger.debug('Reached end of input')
+        finally:
+            if not self._put_batch(None):
+                # wake up the dispatching thread if it's waiting for input
+                try:
+                    self._event_batches.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def _put_batch(self, batch):
+        '''Waits for room in the queue and adds ``batch`` to it. Returns False
+        without adding it if the room is closed meanwhile.'''
+        while self._observer_active:
+            try:
+                self._event_batches.put(batch, timeout=1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _dispatch(self):
+        try:
+            while self._observer_active:
+                batch = self._event_batches.get()
+                if batch is None:
                     break
+                for event in batch:
+                    if not self._observer_active:
+                        break
+                    self._invoke_callbacks(event)
         finally:
             # In case we run out of input before being closed
             self._observer_active = False
 
+    @profiled('transport')
     def _invoke_callbacks(self, event):
         for c in self._callbacks:
             c(event, None)
@@ -90,18 +161,20 @@ class Room(BaseRoomObserver, BaseRoomParticipant):
         if not self._observer_active:
             return
         self._callbacks.append(event_callback)
-        if not self._input_thread.is_alive():
-            logger.debug('Starting reading thread')
+        if not self._threads_started:
+            logger.debug('Starting reading and dispatch threads')
+            self._threads_started = True
+            self._dispatch_thread.start()
             self._input_thread.start()
 
     def send(self, message, reply_target=None):
         message = format_message(message)
         if reply_target:
             logger.debug('Replying with message: {}'.format(repr(message)))
-            print('reply:', message)
+            print('reply:', message, file=self.output)
         else:
             logger.debug('Sending message: {}'.format(repr(message)))
-            print(message)
+            print(message, file=self.output)
 
     def close(self):
         self._observer_active = False
@@ -122,11 +195,14 @@ class Room(BaseRoomObserver, BaseRoomParticipant):
         return self.ping_strings([user_id], quote)[0]
 
     def ping_strings(self, user_ids, quote=False):
-        master_name_mapping = {m['id']: m['name'] for site_mods in moderators.values() for m in site_mods}
         ping_format = code_quote(self.ping_format) if quote else self.ping_format
         superping_format = code_quote(self.superping_format) if quote else self.superping_format
-        pingable_users = {i: master_name_mapping.get(i, 'user{}'.format(i)) for i in self.pingable_user_ids}
-        return [(ping_format.format(pingable_users[i].replace(' ', '')) if i in pingable_users else superping_format.format(i)) for i in user_ids]
+        pingable_users = self.pingable_user_ids
+        return [(ping_format.format(self._user_name(i).replace(' ', '')) if i in pingable_users else superping_format.format(i)) for i in user_ids]
+
+    def _user_name(self, user_id):
+        info = moderator_info(user_id)
+        return info.name if info else 'user{}'.format(user_id)
 
     @property
     def pingable_user_ids(self):
@@ -136,6 +212,12 @@ class Room(BaseRoomObserver, BaseRoomParticipant):
     def present_user_ids(self):
         return self._present_user_ids
 
+    @property
+    def membership_version(self):
+        # The membership is static, but the user names in ping strings come
+        # from the moderator info, so they change when it's reloaded
+        return moderator_generation()
+
     @property
     def observer_active(self):
         return self._observer_active
@@ -1,25 +1,116 @@
+import collections
 import io
 import json
 import logging
 
+from pingbot import sites
+
 logger = logging.getLogger('pingbot.moderators')
 
+# The moderator info and the tables derived from it are replaced as a whole,
+# never modified, so that they can be read from other threads while new info is
+# loaded. Other modules should look them up through this module (or the
+# functions in it) at the time of use, rather than keep references to them.
 moderators = dict()
 
-def update(filename='moderators.json'):
-    global moderators
+ModeratorInfo = collections.namedtuple('ModeratorInfo', ['id', 'name', 'sites'])
+
+# Reverse index mapping each moderator's user ID to a ModeratorInfo, and each
+# ping name (see ping_name()) to the IDs of the moderators who have it. These
+# are rebuilt whenever moderator info is loaded.
+moderator_index = dict()
+_moderator_ids_by_ping_name = dict()
+
+# Counts the times moderator info has been loaded, so that anything derived
+# from it (such as user names) can tell when it's out of date
+_generation = 0
+
+def generation():
+    '''Returns a number which increases each time moderator info is loaded.'''
+    return _generation
+
+def ping_name(name):
+    '''Normalizes a user name the way chat does when matching pings.'''
+    return name.replace(' ', '').lower()
+
+def site_ids():
+    '''Returns a list of the IDs of the sites with moderator info.'''
+    return list(moderators)
+
+def site_moderators(site_id):
+    '''Returns the list of dicts describing the moderators of the given site,
+    or None if there is no info for the site.'''
+    return moderators.get(site_id)
 
+def moderator_info(user_id):
+    '''Returns the ModeratorInfo for the given user ID, or None if they are not
+    a known moderator.'''
+    return moderator_index.get(user_id)
+
+def find_moderators(name):
+    '''Returns a list of the ModeratorInfo for each moderator whose name
+    matches ``name`` as a ping would.'''
+    index = moderator_index
+    # the index may have been replaced since the IDs were looked up
+    return [index[i] for i in _moderator_ids_by_ping_name.get(ping_name(name), ()) if i in index]
+
+def update(filename='moderators.json'):
     with io.open(filename, encoding='UTF-8') as f:
         logger.debug('Opened moderator info file {}'.format(filename))
         mod_info = json.load(f)
 
     logger.info('Loaded moderator info file')
+    load(mod_info)
+
+def load(mod_info):
+    '''Replaces the moderator and site data with the contents of ``mod_info``,
+    which has the structure of the moderator info file.'''
     # Use a 'moderators' section so that we can combine the mod info with other
     # config information in the same file, in the future, if desired
-    moderators.clear()
-    moderators.update(mod_info['moderators'])
+    global moderators, _generation
+    new_moderators = dict(mod_info['moderators'])
+    sites.update(mod_info.get('sites', {}))
+    _build_index(new_moderators)
+    moderators = new_moderators
+    _generation += 1
     logger.debug('Loaded mod info: {}'.format(
         ', '.join(
-            '{} ({})'.format(site, len(mods)) for site, mods in moderators.items()
+            '{} ({})'.format(site, len(mods)) for site, mods in new_moderators.items()
         )
     ))
+
+def _build_index(moderators):
+    global moderator_index, _moderator_ids_by_ping_name
+    mod_sites = collections.defaultdict(list)
+    mod_names = {}
+    for site_id in sorted(moderators):
+        for m in moderators[site_id]:
+            mod_sites[m['id']].append(site_id)
+            mod_names.setdefault(m['id'], m['name'])
+    index = {
+        i: ModeratorInfo(i, mod_names[i], tuple(s)) for i, s in mod_sites.items()
+    }
+    ids_by_ping_name = collections.defaultdict(list)
+    for i, info in index.items():
+        ids_by_ping_name[ping_name(info.name)].append(i)
+
+    moderator_index = index
+    _moderator_ids_by_ping_name = dict(ids_by_ping_name)
+
+def snapshot():
+    '''Returns the moderator and site data along with the tables built from
+    them, for `install()`. It can be pickled to pass it to another process.'''
+    return (moderators, moderator_index, _moderator_ids_by_ping_name, sites.snapshot())
+
+def install(snapshot):
+    '''Replaces the moderator and site data with a snapshot returned by
+    `snapshot()`, without reading the moderator info file or building the
+    tables again.'''
+    global moderators, moderator_index, _moderator_ids_by_ping_name, _generation
+    new_moderators, index, ids_by_ping_name, site_snapshot = snapshot
+    sites.install(site_snapshot)
+    moderator_index = index
+    _moderator_ids_by_ping_name = ids_by_ping_name
+    moderators = new_moderators
+    _generation += 1
+    logger.info('Installed moderator info for {} sites'.format(len(new_moderators)))
@@ -0,0 +1,59 @@
+import collections
+import logging
+import time
+
+logger = logging.getLogger('pingbot.pingledger')
+
+class PingLedger(object):
+    '''A record of which moderators have been pinged recently for which sites,
+    used to avoid pinging the same moderators over and over when several
+    people ask for them within a short time.
+
+    Entries are kept in an `OrderedDict` keyed by (site ID, user ID), in the
+    order they were recorded, so expired entries are always at the front and
+    can be dropped cheaply. At most ``max_entries`` are kept.'''
+    def __init__(self, cooldown=300, max_entries=10000, clock=time.time):
+        self.cooldown = cooldown
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+
+    def _expire(self, now):
+        entries = self._entries
+        cutoff = now - self.cooldown
+        while entries:
+            key, pinged = next(iter(entries.items()))
+            if pinged > cutoff:
+                break
+            del entries[key]
+
+    def record(self, keys):
+        '''Records pings of moderators, given as an iterable of (site ID, user
+        ID) pairs.'''
+        now = self._clock()
+        self._expire(now)
+        entries = self._entries
+        for key in keys:
+            entries[key] = now
+            entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    def recently_pinged(self, keys):
+        '''Checks the given (site ID, user ID) pairs against the ledger, and
+        returns a dict mapping the user ID of each one that was pinged within
+        the cooldown period to the time of their most recent ping.'''
+        self._expire(self._clock())
+        entries = self._entries
+        result = {}
+        for key in keys:
+            pinged = entries.get(key)
+            if pinged is not None and pinged > result.get(key[1], 0):
+                result[key[1]] = pinged
+        return result
+
+def format_elapsed(seconds):
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return 'less than a minute'
+    return '{} minute{}'.format(minutes, 's' if minutes != 1 else '')
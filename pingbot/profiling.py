@@ -0,0 +1,188 @@
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger('pingbot.profiling')
+
+# The profiler which is currently sampling, if any. Profiled functions check
+# this and nothing else when profiling is off.
+_active = None
+# The profiler set up by configure(), whether or not it is sampling
+_profiler = None
+
+def profiled(section):
+    '''Decorator which marks calls of a function as a profiled section named
+    ``section``. While a profiler is running, the stacks of threads inside a
+    profiled section are sampled, under a root frame with the section's name;
+    threads anywhere else (e.g. waiting for events) are ignored. Sections don't
+    nest: inside another profiled function, the outer section's name is used.'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return function(*args, **kwargs)
+            ident = threading.get_ident()
+            sections = profiler._sections
+            if ident in sections:
+                return function(*args, **kwargs)
+            sections[ident] = section
+            try:
+                return function(*args, **kwargs)
+            finally:
+                sections.pop(ident, None)
+        return wrapper
+    return decorator
+
+# Code of the wrapper functions made by profiled(), which is left out of the
+# sampled stacks
+_wrapper_code = profiled(None)(len).__code__
+
+class SamplingProfiler(object):
+    '''Statistical profiler which looks at the stacks of threads in profiled
+    sections every ``interval`` seconds, and every ``dump_interval`` seconds
+    writes the counts of the stacks it has seen to a new file in ``directory``.
+
+    The files are in the "collapsed" format used by flame graph tools such as
+    FlameGraph's flamegraph.pl and speedscope: one line per distinct stack,
+    with the frames from the outermost in, separated by semicolons, then a
+    space and the number of samples.'''
+    def __init__(self, directory, interval=0.01, dump_interval=60):
+        self.directory = directory
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self._sections = {}
+        self._counts = {}
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        global _active
+        if self.running:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='pingbot-profiler')
+        self._thread.daemon = True
+        self._thread.start()
+        _active = self
+        logger.info('Started profiling, sampling every {} s'.format(self.interval))
+
+    def stop(self):
+        '''Stops sampling and writes out any samples not yet written.'''
+        global _active
+        if not self.running:
+            return
+        if _active is self:
+            _active = None
+        self._stopping.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        self._sections.clear()
+        self.dump()
+        logger.info('Stopped profiling')
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = '{} ({}:{})'.format(
+                getattr(code, 'co_qualname', code.co_name),
+                os.path.basename(code.co_filename),
+                code.co_firstlineno
+            ).replace(';', ':')
+        return label
+
+    def sample(self):
+        '''Records the current stack of each thread in a profiled section.'''
+        frames = sys._current_frames()
+        samples = []
+        for ident, section in list(self._sections.items()):
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                if frame.f_code is not _wrapper_code:
+                    stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(section)
+            samples.append(';'.join(reversed(stack)))
+        with self._lock:
+            for stack in samples:
+                self._counts[stack] = self._counts.get(stack, 0) + 1
+
+    def dump(self):
+        '''Writes the stacks sampled since the last dump to a new file, and
+        returns its name, or None if there were no samples.'''
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return None
+        filename = os.path.join(
+            self.directory,
+            'pingbot-{}-{}.collapsed'.format(os.getpid(), time.strftime('%Y%m%d-%H%M%S'))
+        )
+        # in case two dumps happen in the same second
+        n = 1
+        base = filename
+        while os.path.exists(filename):
+            n += 1
+            filename = '{}.{}'.format(base, n)
+        with open(filename + '.tmp', 'w', encoding='UTF-8') as f:
+            for stack, count in sorted(counts.items()):
+                f.write('{} {}\n'.format(stack, count))
+        os.replace(filename + '.tmp', filename)
+        logger.info('Wrote {} samples to {}'.format(sum(counts.values()), filename))
+        return filename
+
+    def _run(self):
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stopping.wait(self.interval):
+            try:
+                self.sample()
+                if time.monotonic() >= next_dump:
+                    next_dump = time.monotonic() + self.dump_interval
+                    self.dump()
+            except:
+                logger.exception('Error while profiling')
+
+def configure(profiling_settings):
+    '''Sets up the profiler as given by a `pingbot.settings.ProfilingSettings`,
+    starting it if it is enabled. A profiler which is already running keeps
+    running, with the new intervals and directory taking effect when it's next
+    started.'''
+    global _profiler
+    if not profiling_settings.directory:
+        if _profiler is not None:
+            _profiler.stop()
+            _profiler = None
+        return
+    if _profiler is None:
+        _profiler = SamplingProfiler(profiling_settings.directory)
+    if not _profiler.running:
+        _profiler.directory = profiling_settings.directory
+        _profiler.interval = profiling_settings.interval
+        _profiler.dump_interval = profiling_settings.dump_interval
+    if profiling_settings.enabled:
+        _profiler.start()
+
+def profiler():
+    '''Returns the profiler set up by `configure()`, or None if profiling isn't
+    configured.'''
+    return _profiler
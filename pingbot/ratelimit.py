@@ -0,0 +1,121 @@
+import logging
+import time
+
+logger = logging.getLogger('pingbot.ratelimit')
+
+# Command classes, which are rate limited independently
+INFO = 'info'
+PING = 'ping'
+SUPERPING = 'superping'
+# Commands only available to administrators, which have no limits, so that
+# they work even while the room is being flooded
+ADMIN = 'admin'
+
+# Default limits, as (number of commands, period in seconds). Each poster can
+# run that many commands of the class in any such period, and a burst of up to
+# that many at once.
+DEFAULT_USER_LIMITS = {
+    INFO: (10, 60),
+    PING: (5, 60),
+    SUPERPING: (2, 300),
+}
+# Limits on commands from all posters in the room together
+DEFAULT_ROOM_LIMITS = {
+    INFO: (60, 60),
+    PING: (20, 60),
+    SUPERPING: (5, 300),
+}
+
+USER_NOTICE = 'You\'re sending {} commands too quickly; please wait a bit.'
+ROOM_NOTICE = 'Too many {} commands in this room; please wait a bit.'
+
+class RateLimiter(object):
+    '''Token bucket rate limiter for commands, keyed by poster ID and command
+    class, plus one bucket per command class for the room as a whole.
+
+    Each bucket is stored as a list of [tokens, last update time, notified],
+    where notified records whether the poster has already been told that they
+    were limited, so that they get only one notice until a command is allowed
+    again. Buckets which would have refilled completely are removed by a sweep
+    that runs at most once per ``sweep_interval`` seconds.
+
+    This isn't thread-safe; each instance should be used from the thread that
+    dispatches events for one room.'''
+    def __init__(self, user_limits=None, room_limits=None, sweep_interval=600, clock=time.monotonic):
+        self.set_limits(user_limits, room_limits)
+        self._buckets = {}
+        self._sweep_interval = sweep_interval
+        self._clock = clock
+        self._next_sweep = clock() + sweep_interval
+
+    def set_limits(self, user_limits=None, room_limits=None):
+        '''Replaces the limits. Existing buckets keep their tokens, up to the new
+        capacity.'''
+        rates = {}
+        for scope, limits in (('user', user_limits or DEFAULT_USER_LIMITS), ('room', room_limits or DEFAULT_ROOM_LIMITS)):
+            for command_class, (count, period) in limits.items():
+                # capacity, tokens added per second
+                rates[scope, command_class] = (float(count), float(count) / period)
+        self._rates = rates
+
+    def _refill(self, key, rate, now):
+        capacity, fill_rate = rate
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now, False]
+        else:
+            tokens = bucket[0] + (now - bucket[1]) * fill_rate
+            bucket[0] = tokens if tokens < capacity else capacity
+            bucket[1] = now
+        return bucket
+
+    def check(self, poster_id, command_class):
+        '''Records an attempt by ``poster_id`` to run a command of the given
+        class. Returns a tuple of whether the command is allowed, and a notice
+        to send to the poster if it is not allowed and they haven't already
+        been told (otherwise None).'''
+        now = self._clock()
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        buckets = []
+        for scope, key in (('user', (poster_id, command_class)), ('room', (None, command_class))):
+            rate = self._rates.get((scope, command_class))
+            if rate is None:
+                continue
+            bucket = self._refill(key, rate, now)
+            if bucket[0] < 1:
+                notice = None
+                if not bucket[2]:
+                    bucket[2] = True
+                    notice = (USER_NOTICE if scope == 'user' else ROOM_NOTICE).format(command_class)
+                logger.info('Rate limited {} command from {} ({} limit)'.format(command_class, poster_id, scope))
+                return False, notice
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket[0] -= 1
+            bucket[2] = False
+        return True, None
+
+    def sweep(self, now=None):
+        '''Removes buckets which have refilled completely, since they are
+        equivalent to new ones.'''
+        if now is None:
+            now = self._clock()
+        self._next_sweep = now + self._sweep_interval
+        full = []
+        for key, (tokens, updated, notified) in self._buckets.items():
+            scope = 'room' if key[0] is None else 'user'
+            rate = self._rates.get((scope, key[1]))
+            if rate is None or tokens + (now - updated) * rate[1] >= rate[0]:
+                full.append(key)
+        for key in full:
+            del self._buckets[key]
+        logger.debug('Removed {} idle rate limit buckets, {} remain'.format(len(full), len(self._buckets)))
+
+def parse_limit(value):
+    '''Parses a limit written as "count/seconds", e.g. "5/60". Raises
+    ValueError if it isn't in that form.'''
+    count, period = value.split('/', 1)
+    return int(count), float(period)
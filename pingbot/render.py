@@ -0,0 +1,74 @@
+import logging
+
+logger = logging.getLogger('pingbot.render')
+
+# Chat rejects single-line messages longer than 500 characters. Leave room for
+# the "[auto] " prefix and the ":<message ID> " that marks a reply.
+MAX_MESSAGE_LENGTH = 500 - len('[auto] ') - len(':1234567890 ')
+
+class PingStringCache(object):
+    '''Caches the ping and superping strings for users in a room, so that each
+    one is only rendered once. The cache is cleared whenever the room's
+    membership version or ping formats change; rooms that don't report a
+    membership version aren't cached at all.'''
+    def __init__(self, room):
+        self._room = room
+        self._key = None
+        self._strings = ({}, {}) # unquoted, quoted
+
+    def _current_cache(self, quote):
+        room = self._room
+        key = (room.membership_version, getattr(room, 'ping_format', None), getattr(room, 'superping_format', None))
+        if key[0] is None:
+            return None
+        if key != self._key:
+            self._key = key
+            self._strings = ({}, {})
+        return self._strings[bool(quote)]
+
+    def ping_string(self, user_id, quote=False):
+        return self.ping_strings([user_id], quote)[0]
+
+    def ping_strings(self, user_ids, quote=False):
+        cache = self._current_cache(quote)
+        if cache is None:
+            return self._room.ping_strings(user_ids, quote)
+        user_ids = list(user_ids)
+        missing = [i for i in user_ids if i not in cache]
+        if missing:
+            cache.update(zip(missing, self._room.ping_strings(missing, quote)))
+        return [cache[i] for i in user_ids]
+
+def build_messages(items, prefix='', suffix='', separator=' ', limit=MAX_MESSAGE_LENGTH):
+    '''Joins ``items`` with ``separator``, with ``prefix`` before the first and
+    ``suffix`` after the last, and splits the result into a list of messages,
+    each no longer than ``limit`` if possible. Messages are only split between
+    items; an item too long to fit in a message gets a message of its own.'''
+    messages = []
+    parts = [prefix]
+    length = len(prefix)
+    first = True
+    for item in items:
+        added = len(item) if first else len(separator) + len(item)
+        if not first and length + added > limit:
+            messages.append(''.join(parts))
+            parts = [item]
+            length = len(item)
+        else:
+            if not first:
+                parts.append(separator)
+            parts.append(item)
+            length += added
+        first = False
+    if length + len(suffix) > limit and length > 0:
+        # start a new message with the suffix, without its leading punctuation
+        messages.append(''.join(parts))
+        parts = [suffix.lstrip(' .,:;')]
+        if not parts[0]:
+            return messages
+    else:
+        parts.append(suffix)
+    messages.append(''.join(parts))
+    if len(messages) > 1:
+        logger.debug('Split reply into {} messages'.format(len(messages)))
+    return messages
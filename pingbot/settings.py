@@ -0,0 +1,244 @@
+import collections
+import logging
+import os
+import types
+
+from pingbot.ratelimit import DEFAULT_USER_LIMITS, DEFAULT_ROOM_LIMITS, parse_limit
+
+logger = logging.getLogger('pingbot.settings')
+
+class ConfigError(Exception):
+    def __init__(self, message, section=None, option=None):
+        if section and option:
+            message = '[{}] {}: {}'.format(section, option, message)
+        elif section:
+            message = '[{}]: {}'.format(section, message)
+        super(ConfigError, self).__init__(message)
+        self.section = section
+        self.option = option
+
+# All settings from the configuration file, parsed and validated. The mappings
+# in here (rooms and the rate limits) are read-only views.
+Settings = collections.namedtuple('Settings', [
+    'filename',
+    'room_id',              # ID of the room to serve, or 'terminal'
+    'rooms',                # maps room IDs to RoomSettings
+    'email',                # None if not given in the file
+    'password',             # None if not given in the file
+    'leave_room_on_close',
+    'watch_tl',
+    'tl_feed',              # path of a TL feed server socket, or None
+    'feed_source',          # 'tl' or 'terminal'
+    'moderators_filename',
+    'terminal',             # TerminalSettings
+    'rate_limits',          # RateLimitSettings
+    'ping_cooldown',        # in seconds; 0 means no cooldown
+    'supervisor',           # SupervisorSettings
+    'profiling',            # ProfilingSettings
+])
+
+RoomSettings = collections.namedtuple('RoomSettings', ['room_id', 'ping_format', 'superping_format'])
+
+TerminalSettings = collections.namedtuple('TerminalSettings', ['user_id', 'present_user_ids', 'pingable_user_ids'])
+
+RateLimitSettings = collections.namedtuple('RateLimitSettings', ['enabled', 'user_limits', 'room_limits'])
+
+SupervisorSettings = collections.namedtuple('SupervisorSettings', ['room_ids', 'workers'])
+
+# directory is None if profiling isn't configured
+ProfilingSettings = collections.namedtuple('ProfilingSettings', ['directory', 'enabled', 'interval', 'dump_interval', 'admin_ids'])
+
+def _get(cfg, section, option, default=None, getter='get'):
+    import configparser
+    try:
+        return getattr(cfg, getter)(section, option)
+    except (configparser.NoSectionError, configparser.NoOptionError):
+        return default
+    except ValueError as e:
+        raise ConfigError(str(e), section, option)
+
+def _room_id(value, section, option):
+    value = value.strip()
+    if value in ('0', 'terminal'):
+        return 'terminal'
+    if not value.isdigit():
+        raise ConfigError('room ID must be a number or "terminal", not {!r}'.format(value), section, option)
+    return value
+
+def _user_ids(value, section, option):
+    try:
+        return frozenset(int(s.strip()) for s in value.split(',') if s.strip())
+    except ValueError:
+        raise ConfigError('expected a comma-separated list of user IDs', section, option)
+
+def _format(cfg, section, option, example):
+    default = cfg.defaults().get(option, '@{}' if option == 'ping_format' else '@@{}')
+    value = _get(cfg, section, option, default)
+    try:
+        value.format(example)
+    except (IndexError, KeyError, ValueError):
+        raise ConfigError('invalid format {!r}; it should contain {{}} once'.format(value), section, option)
+    return value
+
+def _room_settings(cfg, room_id):
+    section = 'room_{}'.format(room_id)
+    return RoomSettings(
+        room_id,
+        _format(cfg, section, 'ping_format', 'user'),
+        _format(cfg, section, 'superping_format', 1)
+    )
+
+def _terminal_settings(cfg):
+    section = 'room_terminal'
+    present = _get(cfg, section, 'present_user_ids')
+    if present is None:
+        present = _get(cfg, section, 'current_user_ids')
+        if present is not None:
+            logger.warning('[room_terminal] current_user_ids is deprecated; use present_user_ids')
+    present = _user_ids(present, section, 'present_user_ids') if present else frozenset()
+    pingable = _get(cfg, section, 'pingable_user_ids')
+    pingable = _user_ids(pingable, section, 'pingable_user_ids') if pingable else frozenset()
+    user_id = _get(cfg, section, 'user_id', 0, 'getint')
+    # present users are always pingable
+    return TerminalSettings(user_id, present, pingable | present)
+
+def _rate_limit_settings(cfg):
+    section = 'rate_limits'
+    user_limits = dict(DEFAULT_USER_LIMITS)
+    room_limits = dict(DEFAULT_ROOM_LIMITS)
+    if cfg.has_section(section):
+        for option in cfg.options(section):
+            if option == 'enabled' or option in cfg.defaults():
+                continue
+            scope, _, command_class = option.partition('_')
+            if scope not in ('user', 'room') or command_class not in DEFAULT_USER_LIMITS:
+                raise ConfigError('unknown rate limit', section, option)
+            try:
+                count, period = parse_limit(cfg.get(section, option))
+            except ValueError:
+                raise ConfigError('expected count/seconds, like 5/60', section, option)
+            if count < 1 or period <= 0:
+                raise ConfigError('count and seconds must be positive', section, option)
+            (user_limits if scope == 'user' else room_limits)[command_class] = (count, period)
+    return RateLimitSettings(
+        _get(cfg, section, 'enabled', True, 'getboolean'),
+        types.MappingProxyType(user_limits),
+        types.MappingProxyType(room_limits)
+    )
+
+def _supervisor_settings(cfg):
+    section = 'supervisor'
+    room_ids = tuple(
+        _room_id(r, section, 'rooms')
+        for r in _get(cfg, section, 'rooms', '').split(',') if r.strip()
+    )
+    if 'terminal' in room_ids:
+        raise ConfigError('the terminal room can\'t be supervised', section, 'rooms')
+    workers = _get(cfg, section, 'workers', None, 'getint')
+    if workers is not None and workers < 1:
+        raise ConfigError('there must be at least one worker', section, 'workers')
+    return SupervisorSettings(room_ids, workers)
+
+def _profiling_settings(cfg):
+    section = 'profiling'
+    directory = _get(cfg, section, 'directory')
+    enabled = _get(cfg, section, 'enabled', False, 'getboolean')
+    if enabled and not directory:
+        raise ConfigError('profiling can\'t be enabled without a directory', section, 'enabled')
+    interval = _get(cfg, section, 'interval', 0.01, 'getfloat')
+    if interval <= 0:
+        raise ConfigError('interval must be positive', section, 'interval')
+    dump_interval = _get(cfg, section, 'dump_interval', 60., 'getfloat')
+    if dump_interval <= 0:
+        raise ConfigError('dump_interval must be positive', section, 'dump_interval')
+    admin_ids = _get(cfg, section, 'admin_user_ids')
+    admin_ids = _user_ids(admin_ids, section, 'admin_user_ids') if admin_ids else frozenset()
+    return ProfilingSettings(directory, enabled, interval, dump_interval, admin_ids)
+
+def parse(filename):
+    '''Reads and validates the whole configuration file, returning a
+    `Settings`. Raises `ConfigError` describing the first problem found.'''
+    # imported here so that importing pingbot doesn't import configparser
+    import configparser
+    cfg = configparser.RawConfigParser()
+    try:
+        if not cfg.read(filename, encoding='UTF-8'):
+            raise ConfigError('unable to read configuration file {}'.format(filename))
+    except configparser.Error as e:
+        raise ConfigError('unable to parse configuration file {}: {}'.format(filename, e))
+
+    room_id = _room_id(_get(cfg, 'room', 'id', 'terminal'), 'room', 'id')
+    supervisor = _supervisor_settings(cfg)
+    rooms = {r: _room_settings(cfg, r) for r in (room_id,) + supervisor.room_ids}
+
+    moderators_filename = _get(cfg, 'moderators', 'filename', 'moderators.json')
+    if not os.path.isfile(moderators_filename):
+        raise ConfigError('moderator info file {} does not exist'.format(moderators_filename), 'moderators', 'filename')
+
+    ping_cooldown = _get(cfg, 'pings', 'cooldown', 300., 'getfloat')
+    if ping_cooldown < 0:
+        raise ConfigError('cooldown can\'t be negative', 'pings', 'cooldown')
+
+    feed_source = _get(cfg, 'feed', 'source', 'tl')
+    if feed_source not in ('tl', 'terminal'):
+        raise ConfigError('source must be "tl" or "terminal"', 'feed', 'source')
+
+    return Settings(
+        filename=filename,
+        room_id=room_id,
+        rooms=types.MappingProxyType(rooms),
+        email=_get(cfg, 'user', 'email'),
+        password=_get(cfg, 'user', 'password'),
+        leave_room_on_close=_get(cfg, 'user', 'leave_on_close', True, 'getboolean'),
+        watch_tl=_get(cfg, 'room', 'watch_tl', False, 'getboolean'),
+        tl_feed=_get(cfg, 'feed', 'socket'),
+        feed_source=feed_source,
+        moderators_filename=moderators_filename,
+        terminal=_terminal_settings(cfg),
+        rate_limits=_rate_limit_settings(cfg),
+        ping_cooldown=ping_cooldown,
+        supervisor=supervisor,
+        profiling=_profiling_settings(cfg)
+    )
+
+_current = None
+_reload_callbacks = []
+
+def load(filename):
+    '''Parses the configuration file and makes the result the current settings.'''
+    global _current
+    _current = parse(filename)
+    logger.info('Loaded settings from {}'.format(filename))
+    return _current
+
+def current():
+    return _current
+
+def on_reload(callback):
+    '''Registers a function to be called with the new settings each time they
+    are reloaded.'''
+    _reload_callbacks.append(callback)
+
+def remove_on_reload(callback):
+    '''Unregisters a function registered with `on_reload()`.'''
+    try:
+        _reload_callbacks.remove(callback)
+    except ValueError:
+        pass
+
+def reload():
+    '''Parses the configuration file again and, if it is valid, makes it the
+    current settings and passes it to the reload callbacks. If it is not valid,
+    this raises `ConfigError` and the current settings stay in effect.'''
+    global _current
+    if _current is None:
+        raise ValueError('No settings have been loaded')
+    settings = parse(_current.filename)
+    _current = settings
+    logger.info('Reloaded settings from {}'.format(settings.filename))
+    for callback in list(_reload_callbacks):
+        try:
+            callback(settings)
+        except:
+            logger.exception('Error applying reloaded settings')
+    return settings
@@ -1,31 +1,62 @@
-_indexed_site_aliases = {
-    "math": ['mathematics'],
-    "linguistics": [],
-    "cstheory": ['tcs'],
-    "cogsci": [],
-    "philosophy": ['phil'],
-    "hsm": [],
-    "chemistry": ['chem'],
-    "stats": ['statistics'],
-    "cs": ['computerscience', 'compsci'],
-    "mathoverflow": ['mo'],
-    "matheducators": ['mathed'],
-    "earthscience": ['earthsci'],
-    "physics": ['phys'],
-    "scicomp": [],
-    "astronomy": ['astro'],
-    "biology": ['bio'],
-    "economics": ['econ']
-}
-
-_site_aliases = {alias: id for (id, aliases) in _indexed_site_aliases.items() for alias in aliases}
+import logging
+
+logger = logging.getLogger('pingbot.sites')
+
+# Site metadata, indexed by canonical site ID. Each value is a dict with keys
+# 'aliases', 'domain', and 'name', as stored in the 'sites' section of the
+# moderator info file.
+sites = dict()
+
+# Lookup tables derived from the site metadata by update(), so that resolving
+# an alias or a domain is a single dict access no matter how many sites exist.
+# Like the metadata, these are replaced as a whole, never modified, so that
+# they can be read from other threads while new metadata is loaded.
+_site_aliases = dict()
+_site_domains = dict()
+_site_display_names = dict()
+
+def update(site_info):
+    '''Replaces the known site metadata with ``site_info``, a dict mapping
+    canonical site IDs to dicts with keys 'aliases', 'domain', and 'name',
+    and rebuilds the lookup tables.'''
+    global sites, _site_aliases, _site_domains, _site_display_names
+    new_sites = dict(site_info)
+
+    aliases = {}
+    for site_id, info in new_sites.items():
+        for alias in info.get('aliases', ()):
+            if alias in aliases and aliases[alias] != site_id:
+                logger.warning('Alias {} used for both {} and {}'.format(alias, aliases[alias], site_id))
+            aliases[alias] = site_id
+
+    _site_aliases = aliases
+    _site_domains = {site_id: info['domain'] for site_id, info in new_sites.items() if 'domain' in info}
+    _site_display_names = {site_id: info['name'] for site_id, info in new_sites.items() if 'name' in info}
+    sites = new_sites
+    logger.debug('Loaded metadata for {} sites with {} aliases'.format(len(sites), len(_site_aliases)))
+
+def snapshot():
+    '''Returns the site metadata and lookup tables, for `install()`.'''
+    return (sites, _site_aliases, _site_domains, _site_display_names)
+
+def install(snapshot):
+    '''Replaces the site metadata and lookup tables with ones returned by
+    `snapshot()`, possibly in another process, without rebuilding them.'''
+    global sites, _site_aliases, _site_domains, _site_display_names
+    new_sites, _site_aliases, _site_domains, _site_display_names = snapshot
+    sites = new_sites
 
 def canonical_site_id(site_id):
     return _site_aliases.get(site_id, site_id)
 
-_site_names = {
-    'mathoverflow': 'mathoverflow.net'
-}
-
 def site_name(site_id):
-    return _site_names.get(site_id, '{}.stackexchange.com'.format(site_id))
+    '''Returns the domain name of the given site.'''
+    site_id = canonical_site_id(site_id)
+    return _site_domains.get(site_id, '{}.stackexchange.com'.format(site_id))
+
+def site_display_name(site_id):
+    '''Returns the human-readable name of the given site, e.g. "Cross Validated"
+    for stats, or its domain name if the name isn't known.'''
+    site_id = canonical_site_id(site_id)
+    name = _site_display_names.get(site_id)
+    return name if name is not None else site_name(site_id)
@@ -0,0 +1,88 @@
+import random
+import string
+
+# Relative frequencies of the command forms in a generated command stream
+# Generated chat messages which aren't commands for the bot
+NON_COMMAND = 'not a command'
+
+COMMAND_WEIGHTS = (
+    ('whois {} mods', 4),
+    ('{} mod', 6),
+    ('any {} mod: synthetic message', 2),
+    ('{} mods', 4),
+    ('all {} mods', 1),
+    ('whois @{}', 2),
+    ('sites', 1),
+    # the wildcard, which takes no site list
+    ('* mod', 1),
+    ('* mods', 1),
+    (NON_COMMAND, 10),
+)
+
+def _random_name(rng, length):
+    return ''.join(rng.choice(string.ascii_lowercase) for i in range(length))
+
+def generate_moderator_info(num_sites=200, mods_per_site=(2, 12), shared_fraction=0.1, seed=None):
+    '''Generates a structure like the contents of the moderator info file, with
+    ``num_sites`` sites each having a number of moderators chosen uniformly from
+    the range ``mods_per_site``. A fraction ``shared_fraction`` of the moderator
+    slots are filled by moderators of other sites, so that some moderators are
+    listed on several sites.'''
+    rng = random.Random(seed)
+    site_info = {}
+    mod_info = {}
+    all_mods = []
+    next_user_id = 1
+    for n in range(num_sites):
+        site_id = 'site{}{}'.format(n, _random_name(rng, 3))
+        site_info[site_id] = {
+            'aliases': ['s{}'.format(n)],
+            'domain': '{}.stackexchange.com'.format(site_id),
+            'name': site_id.title()
+        }
+        site_mods = []
+        for i in range(rng.randint(*mods_per_site)):
+            if all_mods and rng.random() < shared_fraction:
+                m = rng.choice(all_mods)
+                if m in site_mods:
+                    continue
+            else:
+                m = {'id': next_user_id, 'name': 'Mod {}'.format(_random_name(rng, 8))}
+                next_user_id += 1
+                all_mods.append(m)
+            site_mods.append(m)
+        mod_info[site_id] = site_mods
+    return {'sites': site_info, 'moderators': mod_info}
+
+def generate_room_population(mod_info, num_present=200, num_pingable=5000, mod_fraction=0.05, seed=None):
+    '''Generates the sets of present and pingable user IDs for a room. About
+    ``mod_fraction`` of the users are moderators taken from ``mod_info``; the
+    rest have IDs that don't belong to any moderator. The present set is a
+    subset of the pingable set.'''
+    rng = random.Random(seed)
+    mod_ids = sorted(set(m['id'] for mods in mod_info['moderators'].values() for m in mods))
+    num_mods = min(len(mod_ids), int(num_pingable * mod_fraction))
+    pingable = rng.sample(mod_ids, num_mods)
+    first_other_id = (mod_ids[-1] if mod_ids else 0) + 1
+    pingable.extend(range(first_other_id, first_other_id + num_pingable - num_mods))
+    present = rng.sample(pingable, min(num_present, len(pingable)))
+    return set(present), set(pingable)
+
+def generate_commands(mod_info, count=10000, max_sites_per_command=3, seed=None):
+    '''Generates a list of ``count`` chat messages, mostly commands for the bot,
+    referring to sites and moderators in ``mod_info``.'''
+    rng = random.Random(seed)
+    site_ids = sorted(mod_info['moderators'])
+    mod_names = sorted(set(
+        m['name'].replace(' ', '') for mods in mod_info['moderators'].values() for m in mods
+    ))
+    templates = [t for t, w in COMMAND_WEIGHTS for i in range(w)]
+    commands = []
+    for i in range(count):
+        template = rng.choice(templates)
+        if template.startswith('whois @'):
+            arg = rng.choice(mod_names)
+        else:
+            arg = ', '.join(rng.sample(site_ids, rng.randint(1, max_sites_per_command)))
+        commands.append(template.format(arg))
+    return commands
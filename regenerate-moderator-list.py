@@ -6,40 +6,89 @@ except ImportError:
 
 import io
 import json
+import re
 import shutil
 
-# An incomplete mapping of site codes that might be used for pinging to their
-# corresponding domain names
-SITE_CODE_MAPPINGS = {
-    'so': 'stackoverflow.com',
-    'su': 'superuser.com',
-    'sf': 'serverfault.com',
-    'askubuntu': 'askubuntu.com'
+from urllib.parse import urlparse
+
+# Aliases to give to sites that are newly added to the site list. Once a site
+# is in the moderator info file, its aliases are maintained there and this
+# mapping is not consulted again.
+DEFAULT_SITE_ALIASES = {
+    'stackoverflow': ['so'],
+    'superuser': ['su'],
+    'serverfault': ['sf'],
 }
 
-def site_domain_from_key(key):
-    try:
-        return SITE_CODE_MAPPINGS[key]
-    except KeyError:
-        return '{}.stackexchange.com'.format(key)
+def site_key_from_domain(domain):
+    '''Computes the site ID used for pinging from the site's domain name, e.g.
+    physics for physics.stackexchange.com, mathoverflow for mathoverflow.net,
+    and ptstackoverflow for pt.stackoverflow.com. Site IDs in commands are
+    matched as words, so anything else in the domain, like the dot in the
+    last example, is left out.'''
+    if domain.endswith('.stackexchange.com'):
+        key = domain[:-len('.stackexchange.com')]
+    else:
+        key = domain.rsplit('.', 1)[0]
+    return re.sub(r'\W', '', key)
+
+def network_sites():
+    '''Yields (site ID, domain, display name) for each main site on the network,
+    skipping meta sites.'''
+    for site in stackexchange.StackAuth().sites():
+        domain = urlparse(site.site_url).netloc
+        if domain.startswith('meta.') or '.meta.' in domain:
+            continue
+        yield site_key_from_domain(domain), domain, site.name
 
-def update_moderator_list(filename):
+def update_site_list(mod_info, all_sites=False):
+    '''Refreshes the 'sites' section of ``mod_info`` from the network's site
+    list. Only sites already known (in either the 'sites' or 'moderators'
+    section) are included, unless ``all_sites`` is true, in which case every
+    site on the network is added. Returns the set of IDs of the sites which
+    were found in the network's site list.'''
+    site_info = mod_info.get('sites', {})
+    known = set(site_info) | set(mod_info.get('moderators', {}))
+    found = set()
+    for site_key, domain, name in network_sites():
+        if not (all_sites or site_key in known):
+            continue
+        entry = site_info.setdefault(site_key, {})
+        entry.setdefault('aliases', DEFAULT_SITE_ALIASES.get(site_key, []))
+        entry['domain'] = domain
+        entry['name'] = name
+        found.add(site_key)
+    mod_info['sites'] = site_info
+    return found
+
+def update_moderator_list(filename, all_sites=False):
     with io.open(filename, encoding='UTF-8') as f:
         mod_info = json.load(f)
 
-    mod_info['moderators'] = {
+    found = update_site_list(mod_info, all_sites)
+
+    old_moderators = mod_info.get('moderators', {})
+    moderators = {
         site_key: [
             {
                 'name': mod.display_name,
                 'id': mod.id
             }
             for mod in stackexchange.Site(
-                site_domain_from_key(site_key)
+                site['domain']
             ).moderators() # not moderators_elected(), because I want appointed mods too
             if not mod.is_employee and mod.id > 0 # exclude Community
         ]
-        for site_key in mod_info['moderators']
+        for site_key, site in mod_info['sites'].items()
+        if site_key in found
     }
+    # Sites that the network's site list didn't match (e.g. a site ID that
+    # isn't what site_key_from_domain() computes) keep what they had
+    for site_key in sorted((set(mod_info['sites']) | set(old_moderators)) - found):
+        print('Warning: {} is not in the network\'s site list; keeping its existing info'.format(site_key))
+        if site_key in old_moderators:
+            moderators[site_key] = old_moderators[site_key]
+    mod_info['moderators'] = moderators
 
     shutil.copy2(filename, filename + '.backup')
     with io.open(filename, mode='w', encoding='UTF-8') as f:
@@ -47,11 +96,15 @@ def update_moderator_list(filename):
 
 def main():
     import sys
+    args = sys.argv[1:]
+    all_sites = '--all-sites' in args
+    if all_sites:
+        args.remove('--all-sites')
     try:
-        filename = sys.argv[1]
+        filename = args[0]
     except IndexError:
         filename = 'moderators.json'
-    update_moderator_list(filename)
+    update_moderator_list(filename, all_sites)
 
 if __name__ == '__main__':
     main()
@@ -1,8 +1,6 @@
 #!/usr/bin/env python2
 
-import configparser
 import io
-import requests
 import sys
 import time
 
@@ -25,6 +23,13 @@ def initialize_logging(filename=None):
     else:
         logging.basicConfig(level=logging.WARNING)
 
+def connection_errors():
+    '''Return a tuple of the exception classes that indicate a broken connection.
+    This checks for requests in the loaded modules rather than importing it,
+    so that it doesn't get loaded when running without a network connection.'''
+    requests = sys.modules.get('requests')
+    return (requests.ConnectionError,) if requests else ()
+
 def retry_on_connection_error(func, *args, **kwargs):
     '''Call func(*args, **kwargs) and retry if it raises a ConnectionError'''
     import logging
@@ -32,11 +37,11 @@ def retry_on_connection_error(func, *args, **kwargs):
     wait_index = 0
     while True:
         try:
-            start = time.clock()
+            start = time.monotonic()
             # if it returns normally, break out of the loop
             r = func(*args, **kwargs)
-        except requests.ConnectionError:
-            elapsed = time.clock() - start
+        except connection_errors():
+            elapsed = time.monotonic() - start
             logging.info('Function ran for {} seconds'.format(elapsed))
             # A very simple heuristic: if elapsed time is more than five minutes,
             # assume the previous connection was stable for at least a while
@@ -54,16 +59,136 @@ def retry_on_connection_error(func, *args, **kwargs):
             logger.exception('Connection broken; reconnecting in {} seconds'.format(wait_interval))
             time.sleep(wait_interval)
         except:
-            elapsed = time.clock() - start
+            elapsed = time.monotonic() - start
             logging.info('Function ran for {} seconds'.format(elapsed))
             logger.exception('Error in function')
             raise
         else:
-            elapsed = time.clock() - start
+            elapsed = time.monotonic() - start
             logging.info('Function ran for {} seconds'.format(elapsed))
             logger.debug('Function returned normally')
             return r
 
+def load_settings(cfg_filename):
+    '''Parse and validate the whole configuration file, exiting with a message
+    saying what's wrong if it isn't valid.'''
+    from pingbot.settings import load, ConfigError
+    try:
+        return load(cfg_filename)
+    except ConfigError as e:
+        sys.exit('Configuration error: {}'.format(e))
+
+def read_login(settings):
+    '''Return the login email and password, asking for them if they are not in
+    the configuration.'''
+    email = settings.email
+    if email is None:
+        email = input('Email: ')
+    password = settings.password
+    if password is None:
+        import getpass
+        password = getpass.getpass('Password: ')
+    return {'email': email, 'password': password}
+
+def listen_options(settings, need_login=False):
+    '''Return a dict of keyword arguments for the listen functions. Login
+    credentials are only included (and asked for, if necessary) if needed to
+    connect to chat, or if ``need_login`` is true.'''
+    room = settings.rooms[settings.room_id]
+    listen_kwargs = {
+        'leave_room_on_close': settings.leave_room_on_close,
+        'ping_format': room.ping_format,
+        'superping_format': room.superping_format,
+        'watch_tl': settings.watch_tl,
+        'dispatcher_options': {'settings': settings},
+    }
+    if settings.watch_tl and settings.tl_feed:
+        listen_kwargs['tl_feed'] = settings.tl_feed
+    # With a feed, Teachers' Lounge activity doesn't require logging in
+    watch_tl_directly = settings.watch_tl and not settings.tl_feed
+    if need_login or watch_tl_directly or settings.room_id != 'terminal':
+        listen_kwargs.update(read_login(settings))
+    return listen_kwargs
+
+def save_moderator_snapshot(snapshot_file):
+    '''Write the loaded moderator info and the tables built from it to a file
+    shared with other processes, for load_moderator_snapshot(). The file is
+    read and written by position, since forked processes share its offset.'''
+    import os
+    import pickle
+    from pingbot.moderators import snapshot
+    data = pickle.dumps(snapshot(), pickle.HIGHEST_PROTOCOL)
+    fd = snapshot_file.fileno()
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, data, 0)
+
+def load_moderator_snapshot(snapshot_file):
+    import os
+    import pickle
+    from pingbot.moderators import install
+    fd = snapshot_file.fileno()
+    install(pickle.loads(os.pread(fd, os.fstat(fd).st_size, 0)))
+
+def reload_on_sighup(after_reload=None, moderator_snapshot=None):
+    '''Reload the settings and the moderator info when the process receives
+    SIGHUP, and then call ``after_reload``. If the configuration file has
+    become invalid, the old settings stay in effect. If ``moderator_snapshot``
+    is given, the moderator info is installed from that file, as written by
+    save_moderator_snapshot() in another process, instead of being read from
+    the moderator info file.'''
+    import logging
+    import signal
+    logger = logging.getLogger('pingbot.settings')
+
+    def reload(signum, frame):
+        from pingbot import update_moderators
+        from pingbot.settings import reload as reload_settings, ConfigError
+        logger.info('Received SIGHUP, reloading settings')
+        try:
+            settings = reload_settings()
+            if moderator_snapshot:
+                load_moderator_snapshot(moderator_snapshot)
+            else:
+                update_moderators(settings.moderators_filename)
+        except ConfigError as e:
+            logger.error('Not reloading settings due to configuration error: {}'.format(e))
+            return
+        except:
+            logger.exception('Error reloading settings')
+            return
+        if after_reload:
+            after_reload()
+
+    signal.signal(signal.SIGHUP, reload)
+
+def configure_profiling(settings):
+    '''Set up the profiler from the [profiling] section, and again whenever the
+    settings are reloaded.'''
+    from pingbot.profiling import configure
+    from pingbot.settings import on_reload
+    configure(settings.profiling)
+    on_reload(lambda new_settings: configure(new_settings.profiling))
+
+def toggle_profiling_on_sigusr1():
+    '''Start or stop the profiler when the process receives SIGUSR1.'''
+    import logging
+    import signal
+    import threading
+    logger = logging.getLogger('pingbot.profiling')
+
+    def toggle(signum, frame):
+        from pingbot.profiling import profiler
+        p = profiler()
+        if p is None:
+            logger.warning('Received SIGUSR1, but profiling is not configured')
+        else:
+            logger.info('Received SIGUSR1, turning profiling {}'.format('off' if p.running else 'on'))
+            # Stopping writes out the samples, which shouldn't hold up whatever
+            # the signal interrupted
+            threading.Thread(target=p.toggle).start()
+
+    signal.signal(signal.SIGUSR1, toggle)
+
 def main():
     try:
         cfg_filename = sys.argv[1]
@@ -71,77 +196,284 @@ def main():
         cfg_filename = 'pingbot.cfg'
 
     initialize_logging(cfg_filename)
+    settings = load_settings(cfg_filename)
 
-    cfg = configparser.RawConfigParser()
-    cfg.read(cfg_filename)
+    import pingbot
+    pingbot.update_moderators(settings.moderators_filename)
+    listen_kwargs = listen_options(settings)
+    reload_on_sighup()
+    configure_profiling(settings)
+    toggle_profiling_on_sigusr1()
 
-    listen_kwargs = {}
+    if settings.room_id == 'terminal':
+        listen_kwargs['present_user_ids'] = settings.terminal.present_user_ids
+        listen_kwargs['pingable_user_ids'] = settings.terminal.pingable_user_ids
+        listen_kwargs['user_id'] = settings.terminal.user_id
+        listen = pingbot.listen_to_terminal_room
 
-    try:
-        room_id = cfg.get('room', 'id')
-    except configparser.NoOptionError:
-        room_id = 'terminal'
     else:
-        if room_id in ('0', 'terminal'):
-            room_id = 'terminal'
-    try:
-        listen_kwargs['leave_room_on_close'] = cfg.getboolean('user', 'leave_on_close')
-    except configparser.NoOptionError:
-        listen_kwargs['leave_room_on_close'] = True
+        listen_kwargs['room_id'] = settings.room_id
+        listen = pingbot.listen_to_chat_room
 
-    try:
-        listen_kwargs['ping_format'] = cfg.get('room_{}'.format(room_id), 'ping_format')
-    except configparser.NoOptionError:
-        pass
-    try:
-        listen_kwargs['superping_format'] = cfg.get('room_{}'.format(room_id), 'superping_format')
-    except configparser.NoOptionError:
-        pass
+    retry_on_connection_error(listen, **listen_kwargs)
+
+def shard_rooms(room_ids, num_workers):
+    '''Divide the room IDs as evenly as possible among at most num_workers
+    workers.'''
+    return [room_ids[i::num_workers] for i in range(min(num_workers, len(room_ids)))]
 
+def run_worker(room_ids, feed, listen_kwargs, room_options, moderator_snapshot):
+    '''Serve the given rooms in a worker process forked by supervise(). ``feed``
+    is a socket connected to the supervisor's Teachers' Lounge feed, or the path
+    of a feed server's socket, or None. When the settings are reloaded, the
+    moderator info is installed from ``moderator_snapshot``, written by the
+    supervisor.'''
+    import logging
+    import pingbot
+    from pingbot.settings import current as current_settings
+    logger = logging.getLogger('pingbot.supervisor')
+    logger.info('Worker serving rooms {}'.format(', '.join(room_ids)))
+    # The supervisor's signal handlers, which forward the signals to the
+    # workers, are installed after forking, so these don't replace them
+    reload_on_sighup(moderator_snapshot=moderator_snapshot)
+    configure_profiling(current_settings())
+    toggle_profiling_on_sigusr1()
+    tl = None
+    if feed is not None:
+        from pingbot.chat.feed import FeedObserver
+        tl = FeedObserver(path=feed) if isinstance(feed, str) else FeedObserver(feed)
     try:
-        listen_kwargs['watch_tl'] = cfg.getboolean('room', 'watch_tl')
-    except configparser.NoOptionError:
-        pass
+        retry_on_connection_error(
+            pingbot.listen_to_chat_rooms,
+            room_ids=room_ids,
+            tl=tl,
+            room_options=room_options,
+            **listen_kwargs
+        )
+    finally:
+        if tl is not None:
+            tl.close()
 
-    if listen_kwargs['watch_tl'] or room_id != 'terminal':
-        try:
-            listen_kwargs['email'] = cfg.get('user', 'email')
-        except configparser.NoOptionError:
-            listen_kwargs['email'] = input('Email: ')
-        try:
-            listen_kwargs['password'] = cfg.get('user', 'password')
-        except configparser.NoOptionError:
-            import getpass
-            listen_kwargs['password'] = getpass.getpass('Password: ')
+def publish_tl_activity(email, password, feed_sockets, workers, leave_room_on_close=True):
+    '''Watch the Teachers' Lounge and publish its activity to the workers until
+    they all exit.'''
+    from pingbot.chat.feed import FeedPublisher
+    from pingbot.chat.stackexchange import ChatExchangeSession, RoomObserver
+    with ChatExchangeSession(email, password) as ce:
+        # Teachers' Lounge room ID is 4
+        with RoomObserver(ce, 4, leave_room_on_close=leave_room_on_close) as tl:
+            publisher = FeedPublisher(tl)
+            try:
+                for sock in feed_sockets:
+                    publisher.add_subscriber(sock)
+                while tl.observer_active and any(p.is_alive() for p in workers):
+                    time.sleep(1)
+            finally:
+                publisher.close()
 
-    import pingbot
+def supervise(cfg_filename):
+    '''Serve the rooms listed in the [supervisor] section of the configuration
+    file from several worker processes. If watch_tl is set, this process
+    watches the Teachers' Lounge and sends activity updates to the workers over
+    sockets, unless a feed server is configured, in which case the workers
+    subscribe to it directly.
+
+    The moderator info is read and indexed only by this process: once before
+    the workers are forked, so they start with a copy of it, and again when
+    the settings are reloaded, after which the workers install a snapshot of
+    the tables that this process built. Each worker has its own copy of the
+    tables in memory.'''
+    initialize_logging(cfg_filename)
+
+    import logging
+    import multiprocessing
+    import os
+    import signal
+    import socket
+    import tempfile
+    logger = logging.getLogger('pingbot.supervisor')
+
+    settings = load_settings(cfg_filename)
+    room_ids = settings.supervisor.room_ids
+    if not room_ids:
+        sys.exit('Configuration error: [supervisor] rooms: no rooms to serve')
+    num_workers = settings.supervisor.workers or multiprocessing.cpu_count()
+    room_options = {
+        r: {'ping_format': settings.rooms[r].ping_format, 'superping_format': settings.rooms[r].superping_format}
+        for r in room_ids
+    }
+
+    from pingbot import update_moderators
+    update_moderators(settings.moderators_filename)
+    listen_kwargs = listen_options(settings, need_login=True)
+    watch_tl = listen_kwargs.pop('watch_tl', False)
+    tl_feed = listen_kwargs.pop('tl_feed', None) if watch_tl else None
+    for option in ('ping_format', 'superping_format'):
+        listen_kwargs.pop(option, None)
+
+    # An unnamed file, which the workers inherit, for passing them the
+    # moderator info when it's reloaded
+    moderator_snapshot = tempfile.TemporaryFile(prefix='pingbot-')
+    # Fork the workers before this process starts any threads
+    context = multiprocessing.get_context('fork')
+    workers = []
+    feed_sockets = []
+    for n, shard in enumerate(shard_rooms(room_ids, num_workers)):
+        if watch_tl and not tl_feed:
+            feed_socket, worker_socket = socket.socketpair()
+        else:
+            feed_socket = worker_socket = None
+        worker = context.Process(
+            target=run_worker,
+            name='pingbot-worker-{}'.format(n),
+            args=(shard, worker_socket or tl_feed, listen_kwargs, room_options, moderator_snapshot)
+        )
+        worker.start()
+        workers.append(worker)
+        if feed_socket:
+            worker_socket.close()
+            feed_sockets.append(feed_socket)
+    logger.info('Started {} workers for {} rooms'.format(len(workers), len(room_ids)))
+
+    def forward_signal(signum, frame=None):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signum)
+    # Only installed now, so that the workers don't inherit them. The
+    # supervisor doesn't handle any commands, so only the workers profile.
+    def after_reload():
+        save_moderator_snapshot(moderator_snapshot)
+        forward_signal(signal.SIGHUP)
+    reload_on_sighup(after_reload)
+    signal.signal(signal.SIGUSR1, forward_signal)
 
     try:
-        pingbot.update_moderators(cfg.get('moderators', 'filename'))
-    except configparser.NoOptionError:
-        pingbot.update_moderators()
+        if feed_sockets:
+            retry_on_connection_error(
+                publish_tl_activity,
+                listen_kwargs['email'],
+                listen_kwargs['password'],
+                feed_sockets,
+                workers,
+                listen_kwargs['leave_room_on_close']
+            )
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        logger.info('Terminating due to KeyboardInterrupt')
+        for worker in workers:
+            worker.join()
+    finally:
+        for sock in feed_sockets:
+            sock.close()
+        moderator_snapshot.close()
 
-    if room_id == 'terminal':
-        try:
-            listen_kwargs['present_user_ids'] = set(int(s.strip()) for s in cfg.get('room_terminal', 'present_user_ids').split(','))
-        except configparser.NoOptionError:
-            pass
-        try:
-            listen_kwargs['pingable_user_ids'] = set(int(s.strip()) for s in cfg.get('room_terminal', 'pingable_user_ids').split(','))
-        except configparser.NoOptionError:
-            pass
-        try:
-            listen_kwargs['user_id'] = cfg.getint('room_terminal', 'user_id')
-        except configparser.NoOptionError:
-            pass
-        listen = pingbot.listen_to_terminal_room
+def serve_feed(cfg_filename):
+    '''Run the Teachers' Lounge activity feed server configured in the [feed]
+    section of the configuration file, or with "source = terminal", a stand-in
+    that publishes the activity of a terminal room instead.'''
+    initialize_logging(cfg_filename)
 
+    import pingbot
+    settings = load_settings(cfg_filename)
+    if not settings.tl_feed:
+        sys.exit('Configuration error: [feed] socket: no socket path given')
+
+    if settings.feed_source == 'terminal':
+        pingbot.serve_terminal_feed(settings.tl_feed)
     else:
-        listen_kwargs['room_id'] = room_id
-        listen = pingbot.listen_to_chat_room
+        retry_on_connection_error(
+            pingbot.serve_tl_feed,
+            path=settings.tl_feed,
+            leave_room_on_close=settings.leave_room_on_close,
+            **read_login(settings)
+        )
 
-    retry_on_connection_error(listen, **listen_kwargs)
+def stress_test(num_sites=200, num_commands=10000, seed=0):
+    '''Drive the dispatcher through a terminal room with a synthetic moderator
+    database, room population, and command stream, and report throughput and
+    latency percentiles.
+
+    The commands go through the room's input pipeline, and the dispatcher
+    checks a rate limiter and a ping ledger, as in production. To measure the
+    full work of each command rather than the shortcuts, though, the rate
+    limits are set high enough that no command is rejected (all input to a
+    terminal room comes from one user, so otherwise nearly all of them would
+    be), and the ping cooldown is 0, so that no ping is skipped as a repeat.
+    Messages which aren't commands are reported separately.'''
+    initialize_logging()
+
+    import os
+    import pingbot
+    from pingbot import synthetic
+    from pingbot.moderators import load as load_moderators
+    from pingbot.chat.terminal import Room as TerminalRoom
+    from pingbot.pingledger import PingLedger
+    from pingbot.ratelimit import RateLimiter, DEFAULT_USER_LIMITS
 
+    setup_start = time.perf_counter()
+    mod_info = synthetic.generate_moderator_info(num_sites, seed=seed)
+    load_moderators(mod_info)
+    present, pingable = synthetic.generate_room_population(mod_info, seed=seed)
+    commands = synthetic.generate_commands(mod_info, num_commands, seed=seed)
+    poster = min(pingable)
+    setup_time = time.perf_counter() - setup_start
+    print('Generated {} sites, {} moderators, {} pingable users and {} messages in {:.2f} s'.format(
+        len(mod_info['moderators']),
+        len(pingbot.moderators.moderator_index),
+        len(pingable),
+        len(commands),
+        setup_time
+    ))
+
+    unlimited = {command_class: (num_commands, 1) for command_class in DEFAULT_USER_LIMITS}
+    rate_limiter = RateLimiter(unlimited, unlimited)
+    input_data = io.BytesIO(''.join(c + '\n' for c in commands).encode('UTF-8'))
+    latencies = []
+    non_command_latencies = []
+    with io.open(os.devnull, 'w') as devnull:
+        with TerminalRoom(user_id=poster, present_user_ids=present | {poster}, pingable_user_ids=pingable, output=devnull, input=input_data) as room:
+            with pingbot.Dispatcher(room, rate_limiter=rate_limiter, ping_ledger=PingLedger(cooldown=0)) as dp:
+                def timed_on_event(event, client):
+                    start = time.perf_counter()
+                    dp.on_event(event, client)
+                    elapsed = time.perf_counter() - start
+                    if event.content == synthetic.NON_COMMAND:
+                        non_command_latencies.append(elapsed)
+                    else:
+                        latencies.append(elapsed)
+                run_start = time.perf_counter()
+                room.watch(timed_on_event)
+                while room.observer_active:
+                    time.sleep(0.001)
+                run_time = time.perf_counter() - run_start
+
+    def percentile(values, p):
+        return values[min(len(values) - 1, int(len(values) * p / 100.))] * 1e6
+    latencies.sort()
+    non_command_latencies.sort()
+    print('Read and dispatched {} messages from input in {:.2f} s, of which {} were commands: {:.0f} commands/s'.format(
+        len(latencies) + len(non_command_latencies),
+        run_time,
+        len(latencies),
+        len(latencies) / run_time
+    ))
+    print('Command latency: p50 {:.0f} us, p99 {:.0f} us, max {:.0f} us'.format(
+        percentile(latencies, 50), percentile(latencies, 99), latencies[-1] * 1e6
+    ))
+    if non_command_latencies:
+        print('Non-command latency: p50 {:.0f} us'.format(percentile(non_command_latencies, 50)))
+    print('(no command was rate limited or skipped by the ping cooldown; see run.py stress_test)')
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ['stress']:
+        # run.py stress [number of sites] [number of commands] [random seed]
+        stress_test(*(int(a) for a in sys.argv[2:5]))
+    elif sys.argv[1:2] == ['feed']:
+        # run.py feed [config file]
+        serve_feed(sys.argv[2] if len(sys.argv) > 2 else 'pingbot.cfg')
+    elif sys.argv[1:2] == ['supervise']:
+        # run.py supervise [config file]
+        supervise(sys.argv[2] if len(sys.argv) > 2 else 'pingbot.cfg')
+    else:
+        main()
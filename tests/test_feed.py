@@ -0,0 +1,79 @@
+import io
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from pingbot.chat.feed import FeedObserver, FeedPublisher, FeedServer
+from pingbot.chat.terminal import Room
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class FeedTestCase(unittest.TestCase):
+    '''Publishes the activity of a terminal room, whose input is written to a
+    pipe by the tests.'''
+    def setUp(self):
+        read_fd, write_fd = os.pipe()
+        self.input = os.fdopen(write_fd, 'wb', buffering=0)
+        self.room = Room(
+            user_id=5,
+            present_user_ids={5, 6},
+            pingable_user_ids={5, 6, 7},
+            input=os.fdopen(read_fd, 'rb', buffering=0),
+            output=io.StringIO()
+        )
+        self.addCleanup(self.room.close)
+        self.addCleanup(self.input.close)
+
+    def post(self, *lines):
+        self.input.write(''.join(line + '\n' for line in lines).encode('UTF-8'))
+
+class TestFeedRoundTrip(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp(prefix='pingbot-test-')
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'feed.sock')
+        self.server = FeedServer(FeedPublisher(self.room), path)
+        self.addCleanup(self.server.close)
+        self.observer = FeedObserver(path=path, reconnect_interval=0.1)
+        self.addCleanup(self.observer.close)
+
+    def test_membership(self):
+        self.assertTrue(wait_until(lambda: self.observer.membership_version > 0))
+        self.assertEqual(self.observer.present_user_ids, frozenset({5, 6}))
+        self.assertEqual(self.observer.pingable_user_ids, frozenset({5, 6, 7}))
+
+    def test_activity(self):
+        self.assertTrue(wait_until(lambda: self.observer.membership_version > 0))
+        self.assertEqual(self.observer.user_last_activity(5), 0)
+        before = time.time()
+        self.post('hello')
+        self.assertTrue(wait_until(lambda: self.observer.user_last_activity(5) > 0))
+        self.assertGreaterEqual(self.observer.user_last_activity(5), before)
+        self.assertEqual(self.observer.user_last_activity(6), 0)
+
+class TestSlowSubscriber(FeedTestCase):
+    def test_dropped_when_queue_full(self):
+        publisher = FeedPublisher(self.room, queue_size=2)
+        self.addCleanup(publisher.close)
+        subscriber, peer = socket.socketpair()
+        self.addCleanup(subscriber.close)
+        self.addCleanup(peer.close)
+        # fill the socket buffer quickly, and then never read from peer
+        subscriber.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024)
+        publisher.add_subscriber(subscriber)
+        self.post(*['message {}'.format(n) for n in range(2000)])
+        self.assertTrue(wait_until(lambda: subscriber.fileno() == -1))
+        self.assertEqual(publisher._subscribers, [])
+
+if __name__ == '__main__':
+    unittest.main()